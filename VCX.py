@@ -1,49 +1,804 @@
 # class Veracross: code adapted from https://github.com/beckf/veracross_api/
-import parse
+import asyncio
+import json
+import math
+import random
+import re
+import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
+import threading
 import time
 import sys
 import os
+import uuid
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from urllib import parse
 
 project_root = Path(__file__).resolve().parents[1]  # /app
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
-from dotenv import load_dotenv, find_dotenv
+_env_loaded = False
+_credentials = None
+_credentials_lock = threading.Lock()
 
-project_root = Path(__file__).resolve().parents[1]  # /app
-load_dotenv(project_root / ".env")
 
-credentials = os.environ['school'], os.environ['client_id'], os.environ['secret']
+def load_env():
+    """
+    Load the project's .env into os.environ (once). Existing variables win.
+    """
+    global _env_loaded
+    with _credentials_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv(project_root / ".env")
+            _env_loaded = True
+
+
+def get_credentials():
+    """
+    (school, client_id, secret) from the environment or .env. Read on demand
+    rather than at import, so importing VCX is cheap and works without them.
+    :return: tuple of three strings. Raises KeyError naming a missing variable.
+    """
+    global _credentials
+    load_env()
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials = os.environ['school'], os.environ['client_id'], os.environ['secret']
+        return _credentials
+
+
+def __getattr__(name):
+    # VCX.credentials still works for older scripts, now read lazily
+    if name == "credentials":
+        return get_credentials()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class TokenManager:
+    """
+    Keeps one bearer token per scope set ("v3", "oneRoster") and only asks
+    the token endpoint again when the cached one is about to expire or has
+    been rejected with a 401.
+
+    fetch is called as fetch(scope_set) and must return (token, expires_in)
+    or None when the token request failed.
+    """
+
+    def __init__(self, fetch, refresh_margin=60):
+        self.fetch = fetch
+        # Refresh this many seconds before the server says the token expires
+        self.refresh_margin = refresh_margin
+        self._tokens = {}  # scope_set -> (token, expires_at)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, scope_set):
+        with self._locks_guard:
+            return self._locks.setdefault(scope_set, threading.Lock())
+
+    def _cached(self, scope_set):
+        entry = self._tokens.get(scope_set)
+        if entry and time.time() < entry[1] - self.refresh_margin:
+            return entry[0]
+        return None
+
+    def get(self, scope_set, force=False):
+        """
+        Return a valid token for scope_set, fetching a new one if needed.
+        Concurrent callers wait on the same refresh instead of each posting
+        to the token endpoint.
+        :param scope_set: "v3" or "oneRoster"
+        :param force: ignore the cached token
+        :return: string: bearer token or None
+        """
+        if not force:
+            token = self._cached(scope_set)
+            if token:
+                return token
+
+        with self._lock_for(scope_set):
+            # Another thread may have refreshed while we waited for the lock
+            if not force:
+                token = self._cached(scope_set)
+                if token:
+                    return token
+
+            result = self.fetch(scope_set)
+            if result is None:
+                return None
+            token, expires_in = result
+            self._tokens[scope_set] = (token, time.time() + int(expires_in or 0))
+            return token
+
+    def expires_in(self, scope_set):
+        """
+        :return: seconds until the cached token for scope_set expires (0 if none)
+        """
+        entry = self._tokens.get(scope_set)
+        return max(0.0, entry[1] - time.time()) if entry else 0.0
+
+    def invalidate(self, scope_set, token=None):
+        """
+        Forget the cached token for scope_set (e.g. after a 401). If token is
+        given, only forget it when it is still the cached one so a token that
+        another thread just refreshed is kept.
+        """
+        with self._locks_guard:
+            entry = self._tokens.get(scope_set)
+            if entry and (token is None or entry[0] == token):
+                del self._tokens[scope_set]
+
+
+class MemoryBucketState:
+    """
+    Token bucket state kept in this process, guarded by a thread lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            yield self._state
+
+
+class FileBucketState:
+    """
+    Token bucket state kept in a small JSON file so several worker processes
+    on one machine share a budget. Access is serialized with flock.
+    """
+
+    def __init__(self, path):
+        import fcntl  # POSIX only; imported here so Windows can still use the memory backend
+        self._fcntl = fcntl
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        with self._lock, open(self.path, "a+", encoding="utf-8") as f:
+            self._fcntl.flock(f, self._fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+            finally:
+                self._fcntl.flock(f, self._fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    """
+    Token bucket that paces requests against the school-wide Veracross quota.
+    Callers reserve a slot before sending a request and sleep only as long as
+    their own slot needs, so requests are spread out instead of running until
+    the quota is gone and then stopping for the whole reset window.
+
+    The bucket refills at capacity / period tokens per second. Rate limit
+    headers from the server pull the bucket down when other clients have
+    used part of the quota.
+    """
+
+    def __init__(self, capacity=300, period=60, state=None):
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+        self.state = state or MemoryBucketState()
+
+    def _refill(self, state, now):
+        tokens = state.get("tokens", self.capacity)
+        updated = state.get("updated", now)
+        state["tokens"] = min(self.capacity, tokens + (now - updated) * self.rate)
+        state["updated"] = now
+
+    def acquire(self):
+        """
+        Reserve one request and wait until it may be sent.
+        :return: float: seconds slept
+        """
+        with self.state.locked() as state:
+            now = time.time()
+            self._refill(state, now)
+            state["tokens"] -= 1
+            # A negative balance is a queue of reservations; ours is the last one
+            wait = max(0.0, -state["tokens"] / self.rate)
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def try_acquire(self):
+        """
+        Take one request only if the bucket has a free slot right now.
+        :return: bool: True if a slot was taken
+        """
+        with self.state.locked() as state:
+            self._refill(state, time.time())
+            if state["tokens"] < 1:
+                return False
+            state["tokens"] -= 1
+            return True
+
+    def update(self, remaining, reset):
+        """
+        Sync the bucket with X-Rate-Limit-Remaining / X-Rate-Limit-Reset.
+        :param remaining: calls the server says are left
+        :param reset: epoch seconds when the server quota resets
+        """
+        with self.state.locked() as state:
+            now = time.time()
+            self._refill(state, now)
+            if remaining < 2:
+                # Nothing left server side: hold new requests until the reset
+                state["tokens"] = min(state["tokens"], -max(0, reset - now) * self.rate)
+            else:
+                state["tokens"] = min(state["tokens"], remaining - 1)
+
+    def available(self):
+        """
+        :return: float: tokens currently in the bucket (negative when callers are queued)
+        """
+        with self.state.locked() as state:
+            self._refill(state, time.time())
+            return state["tokens"]
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def shared_rate_limiter(school, path=None, capacity=300, period=60):
+    """
+    Return the RateLimiter shared by every client for this school in this
+    process. With a path the bucket lives in that file and is also shared
+    with other processes using the same path.
+    """
+    key = (school, str(path) if path else None)
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            state = FileBucketState(path) if path else MemoryBucketState()
+            _rate_limiters[key] = RateLimiter(capacity, period, state)
+        return _rate_limiters[key]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(config):
+    """
+    Return the Veracross client shared by every caller in this process for
+    this school, API client id and scope list, creating it from config the
+    first time. Tokens, the connection pool, the rate limiter and metrics are
+    all thread-safe, so one client can serve every session.
+    """
+    key = (config["school"], config["client_id"], tuple(sorted(config["scopes"])))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = Veracross(config)
+        return _clients[key]
+
+
+class Transport:
+    """
+    HTTP layer under Veracross. Adds connect/read timeouts, retries on
+    connection errors, 429 and 5xx with jittered exponential backoff that
+    honours Retry-After, a cap on the total time spent retrying, and optional
+    hedging of slow GETs.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, session, connect_timeout=5, read_timeout=30, max_retries=4,
+                 backoff=0.5, max_backoff=30, max_retry_time=60, hedge_after=None, log=None, on_sleep=None,
+                 on_response=None):
+        self.session = session
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_time = max_retry_time
+        # Send a second copy of a GET that has not answered after this many
+        # seconds and use whichever comes back first. None disables hedging.
+        self.hedge_after = hedge_after
+        self.log = log or (lambda text: None)
+        # Called with the seconds slept before each retry (e.g. for metrics)
+        self.on_sleep = on_sleep
+        # Called with (url, status, seconds, bytes) for every response received,
+        # retries and hedge copies included; seconds covers only the HTTP exchange
+        self.on_response = on_response
+        self._hedge_pool = None
+        self._hedge_pool_lock = threading.Lock()
+
+    def retry_delay(self, attempt, response=None):
+        """
+        Seconds to wait before retry number attempt (0-based).
+        """
+        if response is not None and response.headers.get("Retry-After"):
+            value = response.headers["Retry-After"]
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        # Full jitter keeps concurrent clients from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method, url, before_send=None, hedge=False, may_hedge=None, **kwargs):
+        """
+        Send a request, retrying transient failures.
+        :param before_send: called before every attempt (e.g. rate limiter acquire)
+        :param hedge: allow hedging this request (only for idempotent GETs)
+        :param may_hedge: called when a hedge copy is due; a false return skips
+                          it (e.g. no free rate limiter slot). Hedges freely if None.
+        :return: requests.Response; the last response if retries ran out.
+                 Raises the last requests exception if no response was ever received.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            response, error = None, None
+            try:
+                # Pace in the calling thread, so time spent waiting on the
+                # rate limiter never counts toward hedge_after
+                if before_send:
+                    before_send()
+                if hedge and self.hedge_after:
+                    response = self._hedged(method, url, may_hedge, kwargs)
+                else:
+                    response = self._send(method, url, kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if error is None and response.status_code not in self.RETRY_STATUSES:
+                return response
+
+            delay = self.retry_delay(attempt, response)
+            elapsed = time.monotonic() - started
+            if attempt >= self.max_retries or elapsed + delay > self.max_retry_time:
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            reason = error if error is not None else f"HTTP {response.status_code}"
+            self.log(f"V-Pull retry {attempt}/{self.max_retries} in {delay:.2f}s after {reason}: {url}")
+            if self.on_sleep:
+                self.on_sleep(delay)
+            time.sleep(delay)
+
+    def _send(self, method, url, kwargs):
+        started = time.perf_counter()
+        response = self.session.request(method, url, **kwargs)
+        if self.on_response:
+            self.on_response(url, response.status_code, time.perf_counter() - started, len(response.content))
+        return response
+
+    def get(self, url, before_send=None, may_hedge=None, **kwargs):
+        return self.request("GET", url, before_send=before_send, hedge=True, may_hedge=may_hedge, **kwargs)
+
+    def _hedged(self, method, url, may_hedge, kwargs):
+        with self._hedge_pool_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vcx-hedge")
+        pool = self._hedge_pool
+
+        def send():
+            return self._send(method, url, kwargs)
+
+        futures = [pool.submit(send)]
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if not done:
+            # The copy needs its own slot; never queue for one, that only adds load
+            if may_hedge is None or may_hedge():
+                self.log(f"V-Pull hedging slow request after {self.hedge_after}s: {url}")
+                futures.append(pool.submit(send))
+            else:
+                self.log(f"V-Pull not hedging slow request, no rate limit slot free: {url}")
+
+        # First successful answer wins; only fail if every copy failed
+        error = None
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except requests.RequestException as e:
+                error = e
+        raise error
+
+
+class ResponseCache:
+    """
+    On-disk (SQLite) cache of successful API responses, keyed by URL (query
+    included) and page number. Entries expire after a per-endpoint TTL; an
+    expired entry with an ETag or Last-Modified is revalidated with a
+    conditional request instead of being downloaded again. The least recently
+    used entries are evicted once the cache grows past max_bytes.
+    """
+
+    # (regex searched in the request URL, seconds). First match wins.
+    DEFAULT_TTLS = (
+        (r"students/[^/?]+/classes", 24 * 3600),
+        (r"students/[^/?]+(\?|$)", 24 * 3600),
+        (r"academics/enrollments", 6 * 3600),
+        (r"report_card/", 15 * 60),
+    )
+    # Headers needed to rebuild a usable response from the cache
+    KEEP_HEADERS = ("Content-Type", "ETag", "Last-Modified", "X-Total-Count", "Link")
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, default_ttl=300, ttls=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or self.DEFAULT_TTLS)]
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    headers TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+
+    @staticmethod
+    def key(url, page=1):
+        return f"{url}#page={page}"
+
+    def ttl_for(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key):
+        """
+        :return: (response, fresh) or (None, False) if nothing is stored
+        """
+        with self._lock:
+            row = self._db.execute("SELECT body, headers, expires_at FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None or time.time() >= row[2]:
+                self.misses += 1
+            else:
+                self.hits += 1
+            if row is None:
+                return None, False
+            with self._db:
+                self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+
+        body, headers, expires_at = row
+        r = requests.Response()
+        r.status_code = 200
+        r._content = body
+        r.headers = requests.structures.CaseInsensitiveDict(json.loads(headers))
+        r.url = key.rsplit("#", 1)[0]
+        return r, time.time() < expires_at
+
+    def put(self, key, response):
+        headers = {k: response.headers[k] for k in self.KEEP_HEADERS if k in response.headers}
+        body = response.content
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, body, json.dumps(headers), now + self.ttl_for(key), now, len(body)))
+            self._evict()
+
+    def refresh(self, key):
+        """
+        Extend an entry's lifetime after the server answered 304 Not Modified.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self.revalidated += 1
+            self._db.execute("UPDATE responses SET expires_at = ?, accessed_at = ? WHERE key = ?",
+                             (now + self.ttl_for(key), now, key))
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def invalidate(self, pattern=None):
+        """
+        Drop entries whose key contains pattern, or everything if no pattern.
+        """
+        with self._lock, self._db:
+            if pattern:
+                self._db.execute("DELETE FROM responses WHERE instr(key, ?) > 0", (pattern,))
+            else:
+                self._db.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "revalidated": self.revalidated,
+                "entries": entries, "bytes": size}
+
+
+class RequestMetrics:
+    """
+    Per-endpoint request counters for a Veracross client. Endpoints are
+    grouped by template, with ids replaced by {id}
+    (report_card/enrollments/{id}/qualitative_grades), so a school-wide run
+    adds up to a handful of series. Every HTTP attempt is counted, retries
+    and hedge copies included, and its latency excludes rate limiter and
+    retry sleeps (those have their own counters).
+
+    Read it with snapshot() (plain dicts) or prometheus() (text exposition
+    format). Thread-safe.
+    """
+
+    # Latency histogram bucket upper bounds, in seconds
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.token_refreshes = {}
+            self.rate_limit_remaining = None
+            self.rate_limit_reset = None
+            self.rate_limit_sleep = 0.0
+            self.rate_limit_waits = 0
+            self.retry_sleep = 0.0
+            self.retries = 0
+
+    @staticmethod
+    def template(path):
+        """
+        Endpoint template for a path relative to the API base: query dropped,
+        any segment containing a digit replaced by {id}.
+        """
+        path = parse.urlsplit(path).path.strip("/")
+        return "/".join("{id}" if re.search(r"\d", part) else part for part in path.split("/"))
+
+    def _endpoint(self, template):
+        stats = self.endpoints.get(template)
+        if stats is None:
+            stats = self.endpoints[template] = {
+                "requests": 0, "statuses": {}, "seconds": 0.0, "buckets": [0] * len(self.BUCKETS),
+                "bytes": 0, "records": 0, "pages": 0,
+            }
+        return stats
+
+    def observe_request(self, template, status, seconds, size):
+        with self._lock:
+            stats = self._endpoint(template)
+            stats["requests"] += 1
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            stats["seconds"] += seconds
+            stats["bytes"] += size
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+                    break
+
+    def observe_page(self, template, records):
+        with self._lock:
+            stats = self._endpoint(template)
+            stats["pages"] += 1
+            stats["records"] += records
+
+    def observe_token(self, scope_set):
+        with self._lock:
+            self.token_refreshes[scope_set] = self.token_refreshes.get(scope_set, 0) + 1
+
+    def observe_rate_limit(self, remaining, reset_in):
+        with self._lock:
+            self.rate_limit_remaining = remaining
+            self.rate_limit_reset = reset_in
+
+    def observe_rate_limit_wait(self, seconds):
+        with self._lock:
+            self.rate_limit_waits += 1
+            self.rate_limit_sleep += seconds
+
+    def observe_retry(self, seconds):
+        with self._lock:
+            self.retries += 1
+            self.retry_sleep += seconds
+
+    def snapshot(self):
+        """
+        :return: dict with per-endpoint stats (including p50/p95 latency
+                 estimated from the histogram) and the client-wide counters
+        """
+        with self._lock:
+            endpoints = {}
+            for template, stats in self.endpoints.items():
+                stats = dict(stats, statuses=dict(stats["statuses"]), buckets=list(stats["buckets"]))
+                stats["mean_seconds"] = stats["seconds"] / stats["requests"] if stats["requests"] else None
+                stats["p50_seconds"] = self._quantile(stats["buckets"], 0.5)
+                stats["p95_seconds"] = self._quantile(stats["buckets"], 0.95)
+                endpoints[template] = stats
+            return {
+                "endpoints": endpoints,
+                "token_refreshes": dict(self.token_refreshes),
+                "rate_limit_remaining": self.rate_limit_remaining,
+                "rate_limit_reset": self.rate_limit_reset,
+                "rate_limit_sleep_seconds": self.rate_limit_sleep,
+                "rate_limit_waits": self.rate_limit_waits,
+                "retries": self.retries,
+                "retry_sleep_seconds": self.retry_sleep,
+            }
+
+    def _quantile(self, buckets, q):
+        """
+        Upper bound of the bucket holding the q-th request, like Prometheus' histogram_quantile.
+        """
+        total = sum(buckets)
+        if not total:
+            return None
+        running = 0
+        for bound, count in zip(self.BUCKETS, buckets):
+            running += count
+            if running >= q * total:
+                return bound
+        return self.BUCKETS[-1]
+
+    def prometheus(self, prefix="vcx"):
+        """
+        :return: str: metrics in the Prometheus text exposition format
+        """
+        def label(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_request_duration_seconds Veracross request latency by endpoint template.",
+            f"# TYPE {prefix}_request_duration_seconds histogram",
+        ]
+        for template, stats in sorted(snap["endpoints"].items()):
+            running = 0
+            for bound, count in zip(self.BUCKETS, stats["buckets"]):
+                running += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f'{prefix}_request_duration_seconds_bucket{{endpoint="{label(template)}",le="{le}"}} {running}')
+            lines.append(f'{prefix}_request_duration_seconds_sum{{endpoint="{label(template)}"}} {stats["seconds"]}')
+            lines.append(f'{prefix}_request_duration_seconds_count{{endpoint="{label(template)}"}} {stats["requests"]}')
+
+        counters = (("requests_total", "Veracross responses by endpoint and status."),
+                    ("response_bytes_total", "Response body bytes by endpoint."),
+                    ("records_total", "Records returned by endpoint."),
+                    ("pages_total", "Pages fetched by endpoint."))
+        for name, help_text in counters:
+            lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} counter"]
+            for template, stats in sorted(snap["endpoints"].items()):
+                if name == "requests_total":
+                    for status, count in sorted(stats["statuses"].items()):
+                        lines.append(f'{prefix}_{name}{{endpoint="{label(template)}",status="{status}"}} {count}')
+                else:
+                    key = {"response_bytes_total": "bytes", "records_total": "records", "pages_total": "pages"}[name]
+                    lines.append(f'{prefix}_{name}{{endpoint="{label(template)}"}} {stats[key]}')
+
+        lines += [f"# HELP {prefix}_token_refreshes_total Bearer tokens issued by scope set.",
+                  f"# TYPE {prefix}_token_refreshes_total counter"]
+        for scope_set, count in sorted(snap["token_refreshes"].items()):
+            lines.append(f'{prefix}_token_refreshes_total{{scope_set="{label(scope_set)}"}} {count}')
+
+        gauges = (("rate_limit_remaining", "Requests left in the current rate limit window.", snap["rate_limit_remaining"]),
+                  ("rate_limit_reset_seconds", "Seconds until the rate limit window resets.", snap["rate_limit_reset"]))
+        for name, help_text, value in gauges:
+            if value is not None:
+                lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} gauge",
+                          f"{prefix}_{name} {value}"]
+
+        totals = (("rate_limit_sleep_seconds_total", "Seconds spent waiting on the rate limiter.",
+                   snap["rate_limit_sleep_seconds"]),
+                  ("retries_total", "Requests retried after a transient failure.", snap["retries"]),
+                  ("retry_sleep_seconds_total", "Seconds spent in retry backoff.", snap["retry_sleep_seconds"]))
+        for name, help_text, value in totals:
+            lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} counter",
+                      f"{prefix}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
 
 class Veracross:
     def __init__(self, config):
+        # VCX_CACHE_PATH and VCX_RATE_LIMIT_PATH may come from .env
+        load_env()
         self.bearer_token = None
         self.school = config["school"]
-        self.token_url = f"https://accounts.veracross.com/{self.school}/oauth/token"
-        self.oneroster_token_url = f"https://accounts.veracross.com/{self.school}/oauth/oneroster"
-        self.api_base_url = f"https://api.veracross.com/{self.school}/v3/"
-        self.oneroster_base_url = f"https://oneroster.veracross.com/{self.school}/ims/oneroster/v1p1/"
+        # URLs can be overridden in config, e.g. to point at a local stub server
+        self.token_url = config.get("token_url",
+                                    f"https://accounts.veracross.com/{self.school}/oauth/token")
+        self.oneroster_token_url = config.get("oneroster_token_url",
+                                              f"https://accounts.veracross.com/{self.school}/oauth/oneroster")
+        self.api_base_url = config.get("api_base_url",
+                                       f"https://api.veracross.com/{self.school}/v3/")
+        self.oneroster_base_url = config.get("oneroster_base_url",
+                                             f"https://oneroster.veracross.com/{self.school}/ims/oneroster/v1p1/")
         self.client_id = config["client_id"]
         self.client_secret = config["client_secret"]
         self.scopes = config["scopes"]
-        # Requests Session
+        # OneRoster and v3 scopes get their own tokens
+        self.scope_sets = {
+            "oneRoster": [s for s in self.scopes if "imsglobal.org" in s],
+            "v3": [s for s in self.scopes if "imsglobal.org" not in s],
+        }
+        self.tokens = TokenManager(self._request_token)
+        # Per-endpoint latency, bytes, records and rate limit counters
+        self.metrics = config.get("metrics") or RequestMetrics()
+        # Default thread pool size for pull(parallel=True) and grade fan-out,
+        # and the cap on requests in flight across every caller of this client
+        # (threads, AsyncVeracross instances, Streamlit sessions)
+        self.max_workers = config.get("max_workers", 4)
+        self.in_flight = threading.BoundedSemaphore(self.max_workers)
+        # One keep-alive session for API and token calls. Each host gets a
+        # pool big enough for every worker (twice that when hedging, which
+        # can have two copies of a request in flight); Transport does the
+        # retrying, so the adapter does not.
         self.session = requests.Session()
+        pool_size = config.get("pool_size", self.max_workers * (2 if config.get("hedge_after") else 1))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size), max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Timeouts, retries and hedging; any Transport option can be set in config
+        self.transport = Transport(self.session, log=self.debug_log, on_sleep=self.metrics.observe_retry,
+                                   on_response=self.observe_response, **{
+            k: config[k] for k in ("connect_timeout", "read_timeout", "max_retries", "backoff",
+                                   "max_backoff", "max_retry_time", "hedge_after") if k in config})
         # Rate limit defaults
         self.rate_limit_remaining = 300
         self.rate_limit_reset = 0
+        # One token bucket per school, shared by every client in the process.
+        # Set rate_limit_path to share it across processes through a file.
+        self.rate_limiter = config.get("rate_limiter") or shared_rate_limiter(
+            self.school, config.get("rate_limit_path", os.environ.get("VCX_RATE_LIMIT_PATH")))
+        # Optional on-disk response cache (config cache_path or VCX_CACHE_PATH)
+        cache_path = config.get("cache_path", os.environ.get("VCX_CACHE_PATH"))
+        self.cache = ResponseCache(cache_path) if cache_path else None
         # Default page size
         self.page_size = 500
+        # OneRoster pages with limit/offset instead of X-Page-Number
+        self.oneroster_page_size = config.get("oneroster_page_size", 1000)
 
         # Session Headers
+        # Authorization is sent per request since v3 and OneRoster use different tokens
         self.session.headers.update({'Accept': 'application/json',
+                                     'Accept-Encoding': 'gzip, deflate',
+                                     'Connection': 'keep-alive',
                                      'X-Page-Size': str(self.page_size)
                                      })
-        # ... (this is the existing line)
-        self.session.headers.update({'Accept': 'application/json',
-                                     'Authorization': f'Bearer {self.bearer_token}'})
 
         # DEBUG Logs
         # When set, dump a bunch of info
@@ -64,26 +819,45 @@ class Veracross:
         if self.debug:
             print(text)
 
-    def get_authorization_token(self):
+    def get_authorization_token(self, scope_set="v3", force=False):
         """
-        Get / refresh bearer token from veracross api.
+        Get bearer token for a scope set, reusing the cached one until it expires.
+        :param scope_set: "v3" or "oneRoster"
+        :param force: fetch a new token even if the cached one is still valid
         :return: string: bearer token
         """
-        s = requests.Session()
+        token = self.tokens.get(scope_set, force=force)
+        if token:
+            self.bearer_token = token
+        return token
 
+    def _request_token(self, scope_set):
+        """
+        Request a new bearer token from veracross api.
+        :param scope_set: "v3" or "oneRoster"
+        :return: tuple: (bearer token, expires_in seconds) or None
+        """
+        # Same session as the API calls, so the token host connection is kept alive too
         headers = {'Accept': 'application/json',
-                   'Content-Type': 'application/x-www-form-urlencoded'}
+                   'Content-Type': 'application/x-www-form-urlencoded',
+                   'X-Page-Size': None}
 
         token_json = {}  # Define in case post fails
 
+        # Never fall back to every configured scope: a token for the wrong
+        # scopes would only fail later with a confusing 401/403
+        scopes = self.scope_sets.get(scope_set)
+        if not scopes:
+            raise ValueError(f"No {scope_set} scopes configured for this client")
+
         try:
             payload = {
                 'client_id': self.client_id,
                 'client_secret': self.client_secret,
                 'grant_type': 'client_credentials',
-                'scope': ' '.join(self.scopes)
+                'scope': ' '.join(scopes)
             }
-            r = s.post(self.token_url, data=payload, headers=headers)
+            r = self.session.post(self.token_url, data=payload, headers=headers, timeout=self.transport.timeout)
 
             # Check for HTTP errors (like 400, 401, 500)
             r.raise_for_status()
@@ -92,12 +866,14 @@ class Veracross:
             token_json = r.json()
 
             # Now, try to get the key
-            self.bearer_token = token_json["access_token"]
+            token = token_json["access_token"]
 
             # --- If we get here, it worked ---
-            self.session.headers.update({'Authorization': 'Bearer ' + self.bearer_token})
-            self.debug_log(f"Bearer token: {self.bearer_token}")
-            return json["access_token"]  # Note: This should be token_json["access_token"]
+            # Veracross tokens last an hour; assume that if expires_in is missing
+            expires_in = token_json.get("expires_in", 3600)
+            self.metrics.observe_token(scope_set)
+            self.debug_log(f"Bearer token ({scope_set}): {token} expires in {expires_in}s")
+            return token, expires_in
 
         except requests.exceptions.HTTPError as e:
             # --- CATCHES HTTP ERRORS (400, 401, 503) ---
@@ -139,9 +915,11 @@ class Veracross:
             wait = reset - now
             self.rate_limit_reset = int(wait)
 
-            if int(headers["X-Rate-Limit-Remaining"]) < 2:
-                self.debug_log("VC rate limit reached. Waiting {} seconds.".format(wait))
-                time.sleep(wait)
+            # The shared limiter paces the next requests instead of sleeping here
+            self.rate_limiter.update(self.rate_limit_remaining, reset)
+            self.metrics.observe_rate_limit(self.rate_limit_remaining, wait)
+            if self.rate_limit_remaining < 2:
+                self.debug_log("VC rate limit reached. Holding requests for {} seconds.".format(wait))
 
             self.debug_log(f"X-Rate-Limit-Remaining Header: {headers['X-Rate-Limit-Remaining']}")
             self.debug_log(f"X-Rate-Limit-Reset Header: {headers['X-Rate-Limit-Reset']}")
@@ -150,73 +928,799 @@ class Veracross:
         else:
             return False
 
-    def pull(self, oneORnot, endpoint, parameters=None):
+    def cache_stats(self):
         """
-        Pull requested data from veracross api.
-        :return: data
+        Response cache hit / miss counts, or an empty dict when caching is off.
         """
-        self.get_authorization_token()
+        return self.cache.stats() if self.cache is not None else {}
 
-        if oneORnot != "oneRoster":
-            if parameters:
-                url = self.api_base_url + endpoint + "?" + parse.urlencode(parameters, safe=':-')
-            else:
-                url = self.api_base_url + endpoint
-        else:
-            url = self.oneroster_base_url + endpoint
+    def acquire_rate_limit(self):
+        waited = self.rate_limiter.acquire()
+        if waited:
+            self.metrics.observe_rate_limit_wait(waited)
+            self.debug_log(f"V-Pull paced by rate limiter for {waited:.2f}s")
 
-        self.debug_log(f"V-Pull URL: {url}")
+    def authorized_get(self, url, scope_set, headers=None):
+        """
+        GET url with the bearer token for scope_set. A 401 is retried once
+        with a freshly issued token in case the cached one was revoked.
+        :return: requests.Response or None if no token could be obtained
+        """
+        r = None
+        for _ in range(2):
+            # Not force=True on the retry: after invalidate() the first thread
+            # to take the scope's lock fetches the new token and the others,
+            # rejected with the same old token, reuse it
+            token = self.get_authorization_token(scope_set)
+            if token is None:
+                return r
+            request_headers = dict(headers or {})
+            request_headers['Authorization'] = f'Bearer {token}'
+            # Keeps shared use within the connection pool, which is sized for max_workers
+            with self.in_flight:
+                r = self.transport.get(url, headers=request_headers, before_send=self.acquire_rate_limit,
+                                       may_hedge=self.rate_limiter.try_acquire)
+            if r.status_code != 401:
+                return r
+            self.debug_log(f"V-Pull 401 with cached {scope_set} token, refreshing")
+            self.tokens.invalidate(scope_set, token)
+        return r
 
-        # Get first page
-        page = 1
-        r = self.session.get(url)
+    def observe_response(self, url, status, seconds, size):
+        self.metrics.observe_request(self.endpoint_template(url), status, seconds, size)
+
+    def endpoint_template(self, url):
+        """
+        Metrics label for url, e.g. "v3/report_card/enrollments/{id}/numeric_grades".
+        """
+        for prefix, base in (("v3/", self.api_base_url), ("oneroster/", self.oneroster_base_url)):
+            if url.startswith(base):
+                return prefix + RequestMetrics.template(url[len(base):])
+        return RequestMetrics.template(url)
+
+    def get_page(self, url, scope_set, page=1, use_cache=True):
+        """
+        Fetch one page. Anything other than a 200 raises requests.HTTPError so
+        a failed page can never be mistaken for the end of a collection.
+        :param use_cache: serve and store the page through the response cache
+        :return: requests.Response
+        """
+        cached, key = None, None
+        headers = {'X-Page-Number': str(page)} if page > 1 else {}
+        if self.cache is not None and use_cache:
+            key = self.cache.key(url, page)
+            cached, fresh = self.cache.get(key)
+            if cached is not None and fresh:
+                self.debug_log(f"V-Pull cache hit: {key}")
+                return cached
+            if cached is not None:
+                # Stale: ask the server whether it changed
+                if "ETag" in cached.headers:
+                    headers['If-None-Match'] = cached.headers["ETag"]
+                if "Last-Modified" in cached.headers:
+                    headers['If-Modified-Since'] = cached.headers["Last-Modified"]
 
+        r = self.authorized_get(url, scope_set, headers=headers or None)
+        if r is None:
+            raise requests.HTTPError(f"Could not get a {scope_set} bearer token for {url}")
+
+        self.debug_log("V-Pull Page Number: {}".format(page))
         self.debug_log(f"V-Pull HTTP Headers: {r.headers}")
         self.debug_log(f"V-Pull HTTP Status Code: {r.status_code}")
 
+        if r.status_code == 304 and cached is not None:
+            self.check_rate_limit(headers=r.headers)
+            self.cache.refresh(key)
+            return cached
+
         if r.status_code == 401:
             # Possible a scope is missing
             self.debug_log(f"V-Pull 401: Missing Scope?")
             self.debug_log(r.text)
-            return None
 
-        if r.status_code == 200:
-            self.check_rate_limit(headers=r.headers)
-            data = r.json()
-            if oneORnot != "oneRoster":
-                data = data['data']
-            last_count = len(data)
-            self.debug_log("V-Pull data length page 1: {}".format(len(data)))
-        else:
-            return None
+        if r.status_code != 200:
+            raise requests.HTTPError(f"V-Pull page {page} returned {r.status_code}", response=r)
+
+        self.check_rate_limit(headers=r.headers)
+        if key is not None:
+            self.cache.put(key, r)
+        return r
+
+    def fetch_page(self, url, scope_set, page, use_cache=True):
+        """
+        Fetch a single X-Page-Number page of a v3 collection.
+        :return: list of records
+        """
+        data = self.get_page(url, scope_set, page, use_cache).json()['data']
+        self.metrics.observe_page(self.endpoint_template(url), len(data))
+        return data
+
+    def iter_remaining_pages(self, url, scope_set, total_pages, max_workers=None, ordered=True,
+                             use_cache=True):
+        """
+        Fetch pages 2..total_pages at the same time on a bounded thread pool.
+        The pool never has more requests in flight than the rate limit allows.
+        :param ordered: yield pages in page order; otherwise as they finish
+        :return: generator of page record lists
+        """
+        pages = list(range(2, total_pages + 1))
+        if not pages:
+            return
+
+        workers = min(max_workers or self.max_workers, len(pages),
+                      max(1, self.rate_limit_remaining - 1))
+        self.debug_log(f"V-Pull fetching {len(pages)} pages with {workers} workers")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self.fetch_page, url, scope_set, page, use_cache): page
+                       for page in pages}
+            try:
+                if ordered:
+                    # Hold finished pages only until the pages before them arrive
+                    by_page = {page: future for future, page in futures.items()}
+                    for page in pages:
+                        yield by_page.pop(page).result()
+                else:
+                    for future in as_completed(futures):
+                        yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def iter_pull(self, oneORnot, endpoint, parameters=None, chunks=False,
+                  parallel=False, max_workers=None, ordered=True, use_cache=True):
+        """
+        Pull requested data from veracross api, yielding it as it arrives
+        instead of building one list in memory.
+        :param chunks: yield one list per page instead of single records
+        :param parallel: for v3 collections, read the total count from the
+                         first page and fetch the remaining pages concurrently
+        :param max_workers: thread pool size for parallel mode
+        :param ordered: yield parallel pages in page order
+        :param use_cache: set False to bypass the response cache for this call
+        :return: generator of records (or page lists). OneRoster collections
+                 are paged with limit/offset; single-object responses are
+                 yielded whole. Raises a requests exception if any page fails.
+        """
+        scope_set = "oneRoster" if oneORnot == "oneRoster" else "v3"
+        base_url = self.oneroster_base_url if oneORnot == "oneRoster" else self.api_base_url
+        url = self.build_url(base_url + endpoint, parameters)
+
+        self.debug_log(f"V-Pull URL: {url}")
+
+        if oneORnot == "oneRoster":
+            yield from self.iter_oneroster(url, chunks, use_cache)
+            return
+
+        # Get first page
+        r = self.get_page(url, scope_set, use_cache=use_cache)
+
+        data = r.json()['data']
+        last_count = len(data)
+        self.metrics.observe_page(self.endpoint_template(url), last_count)
+        self.debug_log("V-Pull data length page 1: {}".format(last_count))
+        yield from self._emit(data, chunks)
+
+        if last_count < self.page_size:
+            return
+
+        # With a total count the remaining pages are known up front
+        total_count = r.headers.get("X-Total-Count")
+        if parallel and total_count:
+            total_pages = math.ceil(int(total_count) / self.page_size)
+            for data in self.iter_remaining_pages(url, scope_set, total_pages, max_workers=max_workers,
+                                                  ordered=ordered, use_cache=use_cache):
+                yield from self._emit(data, chunks)
+            return
 
         # Any other pages to get?
+        page = 1
         while last_count >= self.page_size:
             page += 1
-            r = self.session.get(url,
-                                 headers={'X-Page-Number': str(page)})
-
-            self.debug_log("V-Pull Page Number: {}".format(page))
-            self.debug_log(f"V-Pull HTTP Headers: {r.headers}")
-            self.debug_log(f"V-Pull HTTP Status Code: {r.status_code}")
-
-            # Handle 401
-            if r.status_code == 401:
-                # Possible a scope is missing
-                self.debug_log(f"V-Pull 401: Missing Scope?")
-                self.debug_log(r.text)
-                return None
+            data = self.fetch_page(url, scope_set, page, use_cache)
+            last_count = len(data)
+            self.debug_log("V-Pull data length page {}: {}".format(page, last_count))
+            yield from self._emit(data, chunks)
+
+    def iter_oneroster(self, url, chunks=False, use_cache=True):
+        """
+        Page through a OneRoster collection with limit/offset, following the
+        Link rel="next" header when the server sends one and X-Total-Count
+        otherwise.
+        :return: generator of records (or page lists). A response that is a
+                 single object rather than a collection is yielded whole.
+        """
+        query = dict(parse.parse_qsl(parse.urlsplit(url).query))
+        limit = int(query.get("limit", self.oneroster_page_size))
+        offset = int(query.get("offset", 0))
+        url = self.build_url(url, {"limit": limit, "offset": offset})
+
+        while url:
+            r = self.get_page(url, "oneRoster", use_cache=use_cache)
+            body = r.json()
 
-            if r.status_code == 200:
-                self.check_rate_limit(headers=r.headers)
-                next_page = r.json()
-                last_count = len(next_page['data'])
-                data = data + next_page['data']
+            # Collections look like {"users": [...]}, single objects like {"user": {...}}
+            lists = [v for v in body.values() if isinstance(v, list)] if isinstance(body, dict) else []
+            if len(lists) != 1:
+                self.metrics.observe_page(self.endpoint_template(url), 1)
+                yield body
+                return
+
+            data = lists[0]
+            self.metrics.observe_page(self.endpoint_template(url), len(data))
+            offset += len(data)
+            self.debug_log("V-Pull OneRoster records so far: {}".format(offset))
+            yield from self._emit(data, chunks)
+
+            next_url = r.links.get("next", {}).get("url")
+            total_count = r.headers.get("X-Total-Count")
+            if next_url:
+                url = parse.urljoin(url, next_url)
+            elif not data:
+                url = None
+            elif total_count is not None:
+                url = self.build_url(url, {"offset": offset}) if offset < int(total_count) else None
+            else:
+                url = self.build_url(url, {"offset": offset}) if len(data) >= limit else None
+
+    @staticmethod
+    def build_url(url, parameters=None):
+        """
+        Add or replace query parameters on url.
+        """
+        if not parameters:
+            return url
+        parts = parse.urlsplit(url)
+        query = dict(parse.parse_qsl(parts.query))
+        query.update({k: str(v) for k, v in parameters.items()})
+        return parse.urlunsplit(parts._replace(query=parse.urlencode(query, safe=':-')))
+
+    @staticmethod
+    def _emit(data, chunks):
+        if chunks:
+            yield data
+        else:
+            yield from data
 
-                self.debug_log("V-Pull data length: {}".format(len(data)))
+    def pull(self, oneORnot, endpoint, parameters=None, parallel=False, max_workers=None, ordered=True,
+             use_cache=True):
+        """
+        Pull requested data from veracross api.
+        :param parallel: for v3 collections, read the total count from the
+                         first page and fetch the remaining pages concurrently
+        :param max_workers: thread pool size for parallel mode
+        :param ordered: return parallel pages in page order
+        :param use_cache: set False to bypass the response cache for this call
+        :return: data, or None if any request failed. OneRoster collections
+                 come back as one flat list (e.g. of users), single objects
+                 as the response dict.
+        """
+        pages = self.iter_pull(oneORnot, endpoint, parameters, chunks=True, parallel=parallel,
+                               max_workers=max_workers, ordered=ordered, use_cache=use_cache)
+        try:
+            data = []
+            for page in pages:
+                # A OneRoster single-object response is returned as is
+                if isinstance(page, dict):
+                    return page
+                data.extend(page)
+        except requests.RequestException as e:
+            self.debug_log(f"V-Pull failed: {e}")
+            return None
 
+        self.debug_log("V-Pull data length: {}".format(len(data)))
         return data
 
+    def fetch_enrollment_grades(self, enrollment_ids, kind="qualitative", progress=None, max_workers=None,
+                                use_cache=True):
+        """
+        Pull report card grades for several enrollments concurrently. Every
+        request still goes through the shared rate limiter.
+        :param enrollment_ids: list of v3 enrollment ids
+        :param kind: "qualitative" or "numeric"
+        :param progress: optional callback(done, total, enrollment_id), called
+                         from this thread as each class finishes
+        :param max_workers: thread pool size, defaults to self.max_workers
+        :param use_cache: set False to bypass the response cache
+        :return: dict of enrollment id -> grade list (None if that pull failed)
+        """
+        results = {}
+        if not enrollment_ids:
+            return results
+
+        workers = min(max_workers or self.max_workers, len(enrollment_ids))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self.pull, "non", grades_endpoint(enrollment_id, kind),
+                                   use_cache=use_cache): enrollment_id
+                       for enrollment_id in enrollment_ids}
+            for done, future in enumerate(as_completed(futures), start=1):
+                enrollment_id = futures[future]
+                results[enrollment_id] = future.result()
+                if progress:
+                    progress(done, len(enrollment_ids), enrollment_id)
+
+        # Same order as the ids that were asked for
+        return {enrollment_id: results[enrollment_id] for enrollment_id in enrollment_ids}
+
+
+class AsyncVeracross:
+    """
+    asyncio front end for Veracross with the same pull / token / rate-limit
+    surface. Each request runs on a worker thread against the wrapped client,
+    so tokens and rate-limit state are shared with any sync callers, and at
+    most `concurrency` requests from this instance are in flight at once (the
+    client's own max_workers cap still applies across all instances).
+    """
+
+    def __init__(self, config, concurrency=None):
+        # Accept either a config dict or an existing Veracross client
+        self.client = config if isinstance(config, Veracross) else Veracross(config)
+        # Defaults to the client's worker count, which its connection pool is sized for
+        self.concurrency = concurrency or self.client.max_workers
+        self._semaphore = None
+        self._semaphore_loop = None
+
+    def __repr__(self):
+        return f"Async{self.client!r}"
+
+    @property
+    def rate_limit_remaining(self):
+        return self.client.rate_limit_remaining
+
+    @property
+    def rate_limit_reset(self):
+        return self.client.rate_limit_reset
+
+    @property
+    def metrics(self):
+        return self.client.metrics
+
+    def check_rate_limit(self, headers):
+        return self.client.check_rate_limit(headers)
+
+    def _limit(self):
+        # A semaphore belongs to the loop it was first used on
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def get_authorization_token(self, scope_set="v3", force=False):
+        return await asyncio.to_thread(self.client.get_authorization_token, scope_set, force)
+
+    async def pull(self, oneORnot, endpoint, parameters=None, **kwargs):
+        """
+        Pull requested data from veracross api without blocking the event loop.
+        Accepts the same arguments as Veracross.pull.
+        :return: data
+        """
+        async with self._limit():
+            return await asyncio.to_thread(self.client.pull, oneORnot, endpoint, parameters, **kwargs)
+
+    async def pull_many(self, calls):
+        """
+        Run several pulls concurrently.
+        :param calls: list of (oneORnot, endpoint) or (oneORnot, endpoint, parameters)
+        :return: list of results in the same order as calls
+        """
+        return await asyncio.gather(*(self.pull(*call) for call in calls))
+
+    async def student_pipeline(self, sourced_id, kind="qualitative", progress=None, use_cache=True,
+                               trace=None):
+        """
+        Run the per-student lookup: classes and student record together, then
+        enrollments, then every per-enrollment report card call concurrently.
+        :param sourced_id: OneRoster sourcedId of the student
+        :param kind: "qualitative" or "numeric" grades
+        :param progress: optional callback(done, total, enrollment_id) as grade calls finish
+        :param use_cache: set False to bypass the response cache
+        :param trace: optional Trace; each pull gets a span
+        :return: dict with classes, student, enrollment_ids (filtered flat
+                 [id, name, ...] list) and grades keyed by enrollment id.
+                 Stages after a failed (None) pull are left as None.
+        """
+        result = {"classes": None, "student": None, "enrollment_ids": None, "grades": None}
+
+        async def traced(name, coro):
+            with span(trace, name):
+                return await coro
+
+        result["classes"], result["student"] = await asyncio.gather(
+            traced("pull.classes", self.pull("oneRoster", "students/" + sourced_id + "/classes",
+                                             use_cache=use_cache)),
+            traced("pull.student", self.pull("oneRoster", "students/" + sourced_id, use_cache=use_cache)),
+        )
+        if result["student"] is None:
+            return result
+
+        student_id = result["student"].get('user', {}).get('identifier')
+        enrollments = await traced("pull.enrollments", self.pull(
+            "non", "academics/enrollments?person_id=" + str(student_id), use_cache=use_cache))
+        if enrollments is None:
+            return result
+
+        enrollment_ids = []
+        for item in enrollments:
+            enrollment_ids.append(item.get('id'))
+            enrollment_ids.append(item.get('class_description'))
+        enrollment_ids = filter_pairs(enrollment_ids)
+        result["enrollment_ids"] = enrollment_ids
+
+        with span(trace, "pull.grades", enrollments=len(enrollment_ids) // 2):
+            result["grades"] = await self.fetch_enrollment_grades(enrollment_ids[0::2], kind, progress,
+                                                                  use_cache, trace)
+        return result
+
+    async def student_pipelines(self, sourced_ids, kind="qualitative", progress=None, use_cache=True):
+        """
+        Run student_pipeline for many students at once. Every pull still goes
+        through this client's concurrency limit and the shared rate limiter,
+        so a batch is as fast as the API budget allows and no faster.
+        :param progress: optional callback(sourced_id, result, error) as each student finishes
+        :return: dict of sourced id -> pipeline result, or the exception it raised
+        """
+        async def one(sourced_id):
+            try:
+                result, error = await self.student_pipeline(sourced_id, kind, use_cache=use_cache), None
+            except Exception as e:
+                result, error = e, e
+            if progress:
+                progress(sourced_id, None if error else result, error)
+            return result
+
+        results = await asyncio.gather(*(one(i) for i in sourced_ids))
+        return dict(zip(sourced_ids, results))
+
+    async def fetch_enrollment_grades(self, enrollment_ids, kind="qualitative", progress=None, use_cache=True,
+                                      trace=None):
+        """
+        Coroutine version of Veracross.fetch_enrollment_grades. Calls run
+        under this client's concurrency limit and progress is called on the
+        event loop thread.
+        :return: dict of enrollment id -> grade list (None if that pull failed)
+        """
+        done = 0
+
+        async def grade(enrollment_id):
+            nonlocal done
+            with span(trace, "pull.grade", enrollment_id=enrollment_id):
+                data = await self.pull("non", grades_endpoint(enrollment_id, kind), use_cache=use_cache)
+            done += 1
+            if progress:
+                progress(done, len(enrollment_ids), enrollment_id)
+            return data
+
+        grades = await asyncio.gather(*(grade(i) for i in enrollment_ids))
+        return dict(zip(enrollment_ids, grades))
+
+
+class GradeTableCache:
+    """
+    Bounded in-memory cache for processed grade tables, shared across
+    sessions. Entries expire after ttl seconds, and the least recently used
+    ones are dropped once the estimated memory use passes max_bytes.
+    Keys are (sourcedId, grade_mode, grading period) tuples.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=900):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def size_of(value):
+        # DataFrames know their own footprint; anything else gets a rough estimate
+        if hasattr(value, "memory_usage"):
+            return int(value.memory_usage(deep=True).sum())
+        return sys.getsizeof(value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() >= entry[2]:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.size_of(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.time() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, sourced_id=None):
+        """
+        Drop every entry, or only the ones for one student.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if sourced_id is None or key[0] == sourced_id:
+                    self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries), "bytes": self._bytes}
+
+
+class Trace:
+    """
+    Named timing spans for one lookup. Every finished span is kept in
+    .spans and, when path is set, appended to a JSON lines file tagged with
+    the trace id, so a slow lookup can be taken apart stage by stage later:
+        {"trace": "9f2c...", "lookup": "student", "span": "pull.grades", "start": 0.41, "seconds": 1.93, ...}
+    Spans may be opened from several threads or tasks at once.
+    """
+
+    _write_lock = threading.Lock()
+
+    def __init__(self, name, path=None, max_bytes=10 * 1024 * 1024, **attrs):
+        """
+        :param name: what is being traced, e.g. "student"
+        :param path: JSON lines file; rotated to <path>.1 past max_bytes
+        :param attrs: fields added to every span (e.g. sourcedId)
+        """
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self.attrs = attrs
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Time the body as span name. Yields attrs so the body can add fields.
+        """
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = repr(e)
+            raise
+        finally:
+            self.add(name, start, time.perf_counter() - start, **attrs)
+
+    def add(self, name, start, seconds, **attrs):
+        """
+        Record a span measured elsewhere (start is a time.perf_counter() value).
+        """
+        entry = {"trace": self.trace_id, "lookup": self.name, "span": name,
+                 "time": round(self.started + start - self._t0, 3),
+                 "start": round(start - self._t0, 4), "seconds": round(seconds, 4)}
+        entry.update(self.attrs)
+        entry.update({k: v for k, v in attrs.items() if v is not None})
+        with self._lock:
+            self.spans.append(entry)
+        if self.path is not None:
+            self._write(entry)
+
+    def _write(self, entry):
+        line = json.dumps(entry, default=str) + "\n"
+        with self._write_lock:
+            try:
+                if self.path.exists() and self.path.stat().st_size > self.max_bytes:
+                    os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+                with self.path.open("a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"trace: could not write {self.path}: {e}", file=sys.stderr)
+
+    def summary(self):
+        """
+        :return: spans ordered by start time
+        """
+        with self._lock:
+            return sorted(self.spans, key=lambda entry: entry["start"])
+
+
+def span(trace, name, **attrs):
+    """
+    trace.span(...) when tracing, otherwise a no-op context.
+    """
+    return trace.span(name, **attrs) if trace is not None else nullcontext(attrs)
+
+
+class StackSampler:
+    """
+    Sampling profiler over every thread. cProfile only sees the thread that
+    enabled it, while the pipeline's pulls run on worker threads, so this
+    takes sys._current_frames() every interval seconds instead and counts
+    the stacks. collapsed() gives the "frame;frame;frame count" format that
+    flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, interval=0.005, include=None):
+        """
+        :param include: only keep stacks with a frame from one of these file names
+        """
+        self.interval = interval
+        self.include = tuple(include or ())
+        self.counts = {}
+        self.samples = 0
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.seconds = time.perf_counter() - self._started
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if self.include and not any(name in entry for entry in stack for name in self.include):
+                    continue
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self.samples += 1
+
+    def collapsed(self):
+        """
+        :return: str: one "frame;frame;frame count" line per distinct stack
+        """
+        return "\n".join(f"{stack} {count}" for stack, count in
+                         sorted(self.counts.items(), key=lambda item: -item[1])) + "\n"
+
+    def top(self, n=20):
+        """
+        :return: list of (function, samples) for the n functions most often on top of a stack
+        """
+        leaves = {}
+        for stack, count in self.counts.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        return sorted(leaves.items(), key=lambda item: -item[1])[:n]
+
+
+def grades_endpoint(enrollment_id, kind="qualitative"):
+    """
+    v3 report card endpoint for one enrollment.
+    :param kind: "qualitative" or "numeric"
+    """
+    if kind not in ("qualitative", "numeric"):
+        raise ValueError(f"Unknown grade kind: {kind}")
+    return f"report_card/enrollments/{enrollment_id}/{kind}_grades"
+
+
+GRADE_COLUMNS = {
+    "qualitative": ["class", "grading_period", "description", "score"],
+    "numeric": ["class", "grading_period", "description", "score", "letter_grade"],
+}
+
+# Output column -> path into one report card grade record
+GRADE_FIELDS = {
+    "qualitative": {
+        "grading_period": ("grading_period", "abbreviation"),
+        "description": ("rubric_criteria", "description"),
+        "score": ("proficiency_level", "abbreviation"),
+    },
+    "numeric": {
+        "grading_period": ("grading_period", "abbreviation"),
+        "description": ("grading_period", "description"),
+        "score": ("posted_grade",),
+        "letter_grade": ("posted_letter_grade",),
+    },
+}
+
+
+def _field(records, path):
+    """
+    One column out of a list of nested dicts; missing or null parents give None.
+    """
+    column = records
+    for key in path:
+        column = [value.get(key) if isinstance(value, dict) else None for value in column]
+    return column
+
+
+def normalize_grades(grades, class_of, kind="qualitative", with_enrollment=False):
+    """
+    Turn raw report card payloads into one grade table.
+
+    Qualitative rows without a proficiency level and numeric rows with a
+    posted grade of 0 are dropped, the same rules the page always applied.
+    :param grades: dict of enrollment id -> list of grade records (None for a failed call)
+    :param class_of: dict of enrollment id -> class name, or the flat
+                     [id, name, id, name, ...] list from filter_pairs
+    :param kind: "qualitative" or "numeric"
+    :param with_enrollment: keep an enrollment_id column first
+    :return: pandas DataFrame with the GRADE_COLUMNS for kind; numeric scores are floats
+    """
+    import pandas as pd  # only the grade stages need it
+
+    if kind not in GRADE_FIELDS:
+        raise ValueError(f"Unknown grade kind: {kind}")
+    if isinstance(class_of, list):
+        class_of = dict(zip(class_of[0::2], class_of[1::2]))
+
+    # Flatten once: every grade record tagged with its enrollment
+    enrollment_ids, records = [], []
+    for enrollment_id in class_of:
+        payload = grades.get(enrollment_id)
+        if not isinstance(payload, list):
+            continue
+        enrollment_ids.extend([enrollment_id] * len(payload))
+        records.extend(payload)
+
+    columns = {"enrollment_id": enrollment_ids}
+    columns["class"] = [class_of[enrollment_id] for enrollment_id in enrollment_ids]
+    for name, path in GRADE_FIELDS[kind].items():
+        columns[name] = _field(records, path)
+    df = pd.DataFrame(columns)
+
+    is_record = pd.Series([isinstance(record, dict) for record in records], index=df.index, dtype=bool)
+    if kind == "qualitative":
+        df = df[is_record & df["score"].notna()]
+    else:
+        df["score"] = pd.to_numeric(df["score"], errors="coerce")
+        df = df[is_record & df["score"].ne(0)]
+
+    names = (["enrollment_id"] if with_enrollment else []) + GRADE_COLUMNS[kind]
+    return df[names].reset_index(drop=True)
+
+
+def run_sync(coro):
+    """
+    Run a coroutine from synchronous code (e.g. a Streamlit script) and
+    return its result. Works whether or not an event loop is already running
+    in this thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # Already inside a loop: run on a separate thread with its own loop
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
 
 def find_any_id_by_item(data, item_to_find, to_find, to_return):
     """
@@ -226,10 +1730,15 @@ def find_any_id_by_item(data, item_to_find, to_find, to_return):
     Works with:
       - data: dict with key 'users' -> list[dict]
       - data: list[dict], each with key 'users' -> list[dict]
+      - data: a roster.RosterStore (indexed, case-insensitive lookup)
 
     Returns:
       The value of user[to_return] from the first match, or None if not found.
     """
+    # Indexed store: one SQL lookup instead of the scan below
+    if hasattr(data, "find"):
+        return data.find(item_to_find, to_find, to_return)
+
     # Normalize input to a list of dict containers
     if isinstance(data, dict):
         containers = [data]
@@ -0,0 +1,548 @@
+# benchmark.py
+# Measure the client and the per-student pipeline against a local mock of
+# the Veracross v3 and OneRoster APIs, without touching production.
+#   python benchmark.py                         run every scenario, save results
+#   python benchmark.py --latency 0.05 --rate-limit 120
+#   python benchmark.py --imports-only                 cold-start import times only
+#   python benchmark.py --compare benchmark_results/old.json benchmark_results/new.json
+import argparse
+import ast
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib import parse
+
+from VCX import AsyncVeracross, RateLimiter, Veracross, normalize_grades, run_sync
+
+SCHOOL = "bench"
+RESULTS_DIR = Path("benchmark_results")
+ROOT = Path(__file__).resolve().parent
+
+# Cold-start stages, each timed in a fresh interpreter. "page_imports" is
+# whatever pages/app.py imports at module level (see page_imports()).
+IMPORT_STAGES = {
+    "import_vcx": "import VCX",
+    "import_roster": "import roster",
+    "first_lookup": "import VCX; VCX.normalize_grades({}, [])",
+    "first_chart": "import pandas, matplotlib; matplotlib.use('Agg'); import matplotlib.pyplot",
+}
+
+V3_SCOPES = ['academics.enrollments:list', 'report_card.enrollments.qualitative_grades:list',
+             'report_card.enrollments.numeric_grades:list']
+ONEROSTER_SCOPES = ['https://purl.imsglobal.org/spec/or/v1p1/scope/roster-core.readonly']
+
+
+class MockData:
+    """
+    Deterministic generated payloads, or recorded OneRoster users from a
+    student_list.json dump when one is given.
+    """
+
+    CLASSES = ["English 7", "Math 7", "Science 7", "History 7", "Spanish 7", "Art", "Music",
+               "Study Hall", "Advisory", "Latin 7"]
+    PERIODS = [("Q1", "Quarter 1"), ("Q2", "Quarter 2"), ("Q3", "Quarter 3"), ("Q4", "Quarter 4")]
+    CRITERIA = ["Effort", "Participation", "Homework", "Assessment"]
+
+    def __init__(self, students=500, records=5000, classes_per_student=8, roster=None, seed=1):
+        rng = random.Random(seed)
+        if roster:
+            from roster import _user_dicts
+            with Path(roster).open("r", encoding="utf-8") as f:
+                self.users = _user_dicts(json.load(f))
+        else:
+            self.users = [{
+                "sourcedId": f"S{i:05d}",
+                "status": "active",
+                "dateLastModified": "2025-08-01T00:00:00Z",
+                "identifier": str(100000 + i),
+                "givenName": f"Given{i}",
+                "familyName": f"Family{i}",
+                "email": f"given{i}_family{i}@example.org",
+                "role": "student",
+                "orgs": [{"href": f"https://example.org/orgs/{SCHOOL}", "sourcedId": SCHOOL, "type": "org"}],
+            } for i in range(students)]
+        self.by_sourced_id = {u.get("sourcedId"): u for u in self.users}
+        self.records = [{"id": i, "name": f"record {i}", "value": rng.random()} for i in range(records)]
+        self.classes_per_student = classes_per_student
+        self.rng_seed = seed
+
+    def enrollments(self, person_id):
+        rng = random.Random(f"{self.rng_seed}-{person_id}")
+        names = rng.sample(self.CLASSES, min(self.classes_per_student, len(self.CLASSES)))
+        base = int(person_id) * 100 if str(person_id).isdigit() else rng.randrange(10 ** 6)
+        return [{"id": base + n, "class_description": name, "person_id": person_id}
+                for n, name in enumerate(names)]
+
+    def classes(self, sourced_id):
+        return [{"sourcedId": f"{sourced_id}-C{n}", "classCode": f"{n:04d}", "title": name}
+                for n, name in enumerate(self.CLASSES[:self.classes_per_student])]
+
+    def grades(self, enrollment_id, kind):
+        rng = random.Random(f"{self.rng_seed}-{enrollment_id}-{kind}")
+        rows = []
+        for abbreviation, description in self.PERIODS:
+            if kind == "qualitative":
+                for criterion in self.CRITERIA:
+                    level = rng.choice([None, "1", "2", "3", "4", "5"])
+                    rows.append({"grading_period": {"abbreviation": abbreviation, "description": description},
+                                 "rubric_criteria": {"description": criterion},
+                                 "proficiency_level": {"abbreviation": level} if level else {}})
+            else:
+                grade = rng.choice([0, rng.uniform(60, 100)])
+                rows.append({"grading_period": {"abbreviation": abbreviation, "description": description},
+                             "posted_grade": round(grade, 1),
+                             "posted_letter_grade": "B" if grade else None})
+        return rows
+
+
+class MockServer:
+    """
+    Threaded HTTP server speaking just enough of both APIs for the client:
+    client_credentials tokens, v3 X-Page-Size / X-Page-Number paging with
+    X-Total-Count, OneRoster limit/offset paging with Link headers, rate
+    limit headers over a fixed window (429 with Retry-After when it runs
+    out) and a configurable per-request latency.
+    """
+
+    def __init__(self, data, latency=0.0, jitter=0.0, rate_limit=0, rate_window=60):
+        self.data = data
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.lock = threading.Lock()
+        self.window_start = time.time()
+        self.window_count = 0
+        self.counters = {}
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/{SCHOOL}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-veracross", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters = {}
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def take_rate_limit(self):
+        """
+        :return: (allowed, remaining, reset epoch)
+        """
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.rate_window:
+                self.window_start, self.window_count = now, 0
+            reset = int(self.window_start + self.rate_window)
+            if self.rate_limit and self.window_count >= self.rate_limit:
+                return False, 0, reset
+            self.window_count += 1
+            remaining = self.rate_limit - self.window_count if self.rate_limit else 10 ** 6
+            return True, remaining, reset
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+            # Buffer headers and body into one write; separate small writes
+            # hit Nagle / delayed-ACK stalls of ~40ms per response
+            wbufsize = 64 * 1024
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body, headers=None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+                server.count("bytes", len(payload))
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path.rstrip("/").endswith(("/oauth/token", "/oauth/oneroster")):
+                    server.count("tokens")
+                    self.send_json(200, {"access_token": f"mock-{time.time_ns()}", "expires_in": 3600,
+                                         "token_type": "Bearer"})
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def do_GET(self):
+                if server.latency or server.jitter:
+                    time.sleep(server.latency + random.uniform(0, server.jitter))
+                if not self.headers.get("Authorization", "").startswith("Bearer mock-"):
+                    self.send_json(401, {"error": "invalid token"})
+                    return
+                allowed, remaining, reset = server.take_rate_limit()
+                limit_headers = {"X-Rate-Limit-Remaining": str(remaining), "X-Rate-Limit-Reset": str(reset)}
+                if not allowed:
+                    server.count("throttled")
+                    limit_headers["Retry-After"] = str(max(1, reset - int(time.time())))
+                    self.send_json(429, {"error": "rate limit"}, limit_headers)
+                    return
+
+                parts = parse.urlsplit(self.path)
+                query = dict(parse.parse_qsl(parts.query))
+                path = parts.path[len(f"/{SCHOOL}/"):]
+                server.count("pages")
+                if path.startswith("v3/"):
+                    self.v3(path[3:], query, limit_headers)
+                elif path.startswith("ims/oneroster/v1p1/"):
+                    self.oneroster(path[len("ims/oneroster/v1p1/"):], query, parts.path, limit_headers)
+                else:
+                    self.send_json(404, {"error": "not found"}, limit_headers)
+
+            def v3(self, path, query, headers):
+                match = re.fullmatch(r"report_card/enrollments/(\d+)/(qualitative|numeric)_grades", path)
+                if match:
+                    rows = server.data.grades(int(match.group(1)), match.group(2))
+                elif path == "academics/enrollments":
+                    rows = server.data.enrollments(query.get("person_id"))
+                elif path == "bench/records":
+                    rows = server.data.records
+                else:
+                    self.send_json(404, {"error": "not found"}, headers)
+                    return
+                size = int(self.headers.get("X-Page-Size") or 100)
+                page = int(self.headers.get("X-Page-Number") or 1)
+                data = rows[(page - 1) * size:page * size]
+                server.count("records", len(data))
+                headers["X-Total-Count"] = str(len(rows))
+                self.send_json(200, {"data": data}, headers)
+
+            def oneroster(self, path, query, full_path, headers):
+                match = re.fullmatch(r"students/([^/]+)(/classes)?", path)
+                if path == "students":
+                    users = server.data.users
+                    limit = int(query.get("limit", 100))
+                    offset = int(query.get("offset", 0))
+                    data = users[offset:offset + limit]
+                    headers["X-Total-Count"] = str(len(users))
+                    if offset + limit < len(users):
+                        next_query = parse.urlencode(dict(query, offset=offset + limit))
+                        headers["Link"] = f'<{full_path}?{next_query}>; rel="next"'
+                    server.count("records", len(data))
+                    self.send_json(200, {"users": data}, headers)
+                elif match and match.group(1) in server.data.by_sourced_id:
+                    if match.group(2):
+                        classes = server.data.classes(match.group(1))
+                        server.count("records", len(classes))
+                        self.send_json(200, {"classes": classes}, headers)
+                    else:
+                        server.count("records")
+                        self.send_json(200, {"user": server.data.by_sourced_id[match.group(1)]}, headers)
+                else:
+                    self.send_json(404, {"error": "not found"}, headers)
+
+        return Handler
+
+
+def make_client(server, args):
+    base = server.url
+    return Veracross({
+        "school": SCHOOL,
+        "client_id": "bench",
+        "client_secret": "bench",
+        "scopes": V3_SCOPES + ONEROSTER_SCOPES,
+        "token_url": base + "oauth/token",
+        "oneroster_token_url": base + "oauth/oneroster",
+        "api_base_url": base + "v3/",
+        "oneroster_base_url": base + "ims/oneroster/v1p1/",
+        # A private bucket sized like the mock's quota, and no response cache
+        "rate_limiter": RateLimiter(capacity=args.rate_limit or 10 ** 6, period=args.rate_window),
+        "cache_path": None,
+        "oneroster_page_size": args.oneroster_page_size,
+        "max_workers": args.workers,
+    })
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def measure(server, run, repeat):
+    """
+    Time run() repeat times, then once more under tracemalloc for memory.
+    :return: dict of timings, server-side counts and peak memory
+    """
+    timings, counts = [], []
+    for _ in range(repeat):
+        server.reset_counters()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+        counts.append(dict(server.counters))
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    elapsed = sum(timings) / len(timings)
+    pages = sum(c.get("pages", 0) for c in counts) / len(counts)
+    records = sum(c.get("records", 0) for c in counts) / len(counts)
+    return {
+        "runs": repeat,
+        "seconds_mean": round(elapsed, 4),
+        "seconds_min": round(min(timings), 4),
+        "seconds_p50": round(percentile(timings, 50), 4),
+        "seconds_p95": round(percentile(timings, 95), 4),
+        "pages": pages,
+        "records": records,
+        "bytes": sum(c.get("bytes", 0) for c in counts) / len(counts),
+        "token_requests": sum(c.get("tokens", 0) for c in counts),
+        "throttled": sum(c.get("throttled", 0) for c in counts),
+        "pages_per_sec": round(pages / elapsed, 1) if elapsed else None,
+        "records_per_sec": round(records / elapsed, 1) if elapsed else None,
+        "peak_python_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+def scenarios(server, vc, args):
+    avc = AsyncVeracross(vc, concurrency=args.workers)
+    students = [u["sourcedId"] for u in server.data.users[:args.pipeline_students]]
+
+    def v3_sequential():
+        assert len(vc.pull("non", "bench/records", use_cache=False)) == len(server.data.records)
+
+    def v3_parallel():
+        assert len(vc.pull("non", "bench/records", parallel=True, max_workers=args.workers,
+                           use_cache=False)) == len(server.data.records)
+
+    def oneroster_students():
+        assert len(vc.pull("oneRoster", "students", use_cache=False)) == len(server.data.users)
+
+    def pipeline():
+        for sourced_id in students:
+            result = run_sync(avc.student_pipeline(sourced_id, "qualitative", use_cache=False))
+            normalize_grades(result["grades"], result["enrollment_ids"], "qualitative")
+
+    return {
+        "v3_pull_sequential": v3_sequential,
+        "v3_pull_parallel": v3_parallel,
+        "oneroster_pull_students": oneroster_students,
+        "student_pipeline": pipeline,
+    }
+
+
+def page_imports():
+    """
+    The module-level imports of pages/app.py (minus streamlit, which is not
+    needed to measure them) as one statement, so the page's first-paint
+    import cost can be compared between commits.
+    """
+    tree = ast.parse((ROOT / "pages" / "app.py").read_text(encoding="utf-8"))
+    statements = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            node.names = [alias for alias in node.names if alias.name.split(".")[0] != "streamlit"]
+        elif isinstance(node, ast.ImportFrom):
+            if node.module in ("__future__", "streamlit"):
+                continue
+        else:
+            continue
+        if node.names:
+            statements.append(ast.unparse(node))
+    return "; ".join(statements)
+
+
+def measure_imports(repeat):
+    """
+    Time each import stage in a fresh interpreter, minus the cost of an
+    empty interpreter start.
+    :return: dict of stage -> {"ms_mean", "ms_min", "statement"}
+    """
+    env = dict(os.environ)
+    # Older trees read credentials at import time; any value will do
+    for name in ("school", "client_id", "secret"):
+        env.setdefault(name, "bench")
+
+    def wall(statement):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            done = subprocess.run([sys.executable, "-c", statement], cwd=ROOT, env=env, capture_output=True)
+            times.append(time.perf_counter() - start)
+            if done.returncode:
+                return None
+        return times
+
+    baseline = min(wall("pass"))
+    stages = dict(IMPORT_STAGES, page_imports=page_imports())
+    results = {}
+    for name, statement in stages.items():
+        times = wall(statement)
+        if times is None:
+            print(f"  {name}: failed to run, skipped", file=sys.stderr)
+            continue
+        results[name] = {
+            "ms_mean": round((sum(times) / len(times) - baseline) * 1000, 1),
+            "ms_min": round((min(times) - baseline) * 1000, 1),
+            "statement": statement,
+        }
+    return results
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def run(args):
+    print("timing cold-start imports ...", flush=True)
+    imports = measure_imports(max(args.repeat, 5))
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "out_dir", "only")},
+        "imports": imports,
+        "results": {},
+    }
+    if args.imports_only:
+        report["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        return report
+
+    data = MockData(students=args.students, records=args.records, roster=args.roster)
+    server = MockServer(data, latency=args.latency, jitter=args.jitter,
+                        rate_limit=args.rate_limit, rate_window=args.rate_window).start()
+    try:
+        vc = make_client(server, args)
+        # Warm the tokens once so the first scenario is not charged for them
+        vc.get_authorization_token("v3")
+        vc.get_authorization_token("oneRoster")
+
+        results = {}
+        selected = set(args.only or [])
+        for name, fn in scenarios(server, vc, args).items():
+            if selected and name not in selected:
+                continue
+            print(f"running {name} ...", flush=True)
+            results[name] = measure(server, fn, args.repeat)
+            # End-to-end latency per student for the pipeline
+            if name == "student_pipeline":
+                n = max(1, min(args.pipeline_students, len(data.users)))
+                results[name]["seconds_per_student"] = round(results[name]["seconds_mean"] / n, 4)
+    finally:
+        server.stop()
+
+    report["results"] = results
+    report["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return report
+
+
+def print_report(report):
+    print(f"\ncommit {report['commit']}  {report['timestamp']}  max RSS {report['max_rss_mb']} MB")
+    header = f"{'scenario':<26}{'mean s':>9}{'p95 s':>9}{'pages/s':>10}{'records/s':>12}{'peak MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, r in report["results"].items():
+        print(f"{name:<26}{r['seconds_mean']:>9.3f}{r['seconds_p95']:>9.3f}"
+              f"{r['pages_per_sec'] or 0:>10.1f}{r['records_per_sec'] or 0:>12.1f}{r['peak_python_mb']:>9.2f}")
+    if report.get("imports"):
+        print(f"\n{'cold-start stage':<26}{'mean ms':>9}{'min ms':>9}")
+        for name, r in report["imports"].items():
+            print(f"{name:<26}{r['ms_mean']:>9.1f}{r['ms_min']:>9.1f}")
+
+
+def compare(old_path, new_path):
+    """
+    Print the change in each metric between two saved result files.
+    """
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']}")
+    metrics = ("seconds_mean", "seconds_p95", "pages_per_sec", "records_per_sec", "peak_python_mb")
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        print(name)
+        for metric in metrics:
+            a, b = old["results"][name].get(metric), new["results"][name].get(metric)
+            if not a or b is None:
+                continue
+            print(f"  {metric:<18}{a:>12.3f}{b:>12.3f}{(b - a) / a * 100:>+9.1f}%")
+    old_imports, new_imports = old.get("imports") or {}, new.get("imports") or {}
+    for name in sorted(set(old_imports) & set(new_imports)):
+        a, b = old_imports[name]["ms_mean"], new_imports[name]["ms_mean"]
+        if a:
+            print(f"{name:<20}{a:>12.1f}{b:>12.1f} ms{(b - a) / a * 100:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Veracross client against a local mock server.")
+    parser.add_argument("--students", type=int, default=500, help="OneRoster users served by the mock")
+    parser.add_argument("--roster", help="serve recorded users from a student_list.json dump instead")
+    parser.add_argument("--records", type=int, default=5000, help="records in the v3 bench collection")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every GET")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument("--rate-limit", type=int, default=0, help="requests per window (0 = unlimited)")
+    parser.add_argument("--rate-window", type=int, default=60, help="rate limit window in seconds")
+    parser.add_argument("--oneroster-page-size", type=int, default=100, help="OneRoster limit per page")
+    parser.add_argument("--workers", type=int, default=4, help="concurrency for parallel scenarios")
+    parser.add_argument("--pipeline-students", type=int, default=5, help="students per pipeline run")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per scenario")
+    parser.add_argument("--only", nargs="*", help="run only these scenarios")
+    parser.add_argument("--imports-only", action="store_true", help="only time cold-start imports")
+    parser.add_argument("--out-dir", default=str(RESULTS_DIR), help="where result files are saved")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    report = run(args)
+    print_report(report)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_path = out_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json"
+    with out_path.open("w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {out_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
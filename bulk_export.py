@@ -0,0 +1,123 @@
+# bulk_export.py
+# School-wide report card export for registrars. Run at the end of a grading period:
+#   python bulk_export.py --kind qualitative --out interims.csv
+# An interrupted run picks up where it stopped when started again with the same --out.
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from VCX import GRADE_COLUMNS, Veracross, filter_pairs, get_credentials, normalize_grades
+
+SCOPES = ['academics.enrollments:list', 'academics.enrollments:read',
+          'report_card.enrollments.qualitative_grades:list',
+          'report_card.enrollments.numeric_grades:list']
+
+
+def load_checkpoint(path, kind):
+    """
+    Read finished enrollments from the checkpoint file.
+    :param kind: grade kind of this run; a checkpoint written for another kind raises ValueError
+    :return: dict of enrollment id -> grade list
+    """
+    done = {}
+    if not path.exists():
+        return done
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a half-written last line from an interrupted run
+            if entry.get("kind") != kind:
+                raise ValueError(f"{path} holds {entry.get('kind') or 'unlabelled'} grades, not {kind}; "
+                                 f"use another --out or --checkpoint, or delete it to start over.")
+            done[entry["enrollment_id"]] = entry["grades"]
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export report card grades for every student.")
+    parser.add_argument("--kind", choices=["qualitative", "numeric"], default="qualitative",
+                        help="qualitative (interims) or numeric grades")
+    parser.add_argument("--out", default="grades_export.csv", help="CSV file to write")
+    parser.add_argument("--checkpoint", help="progress file (default: <out>.checkpoint.jsonl)")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent report card requests")
+    parser.add_argument("--batch", type=int, default=50, help="enrollments per checkpoint write")
+    parser.add_argument("--grading-period", help="only keep rows for this grading period abbreviation")
+    args = parser.parse_args()
+
+    out_path = Path(args.out)
+    checkpoint_path = Path(args.checkpoint or str(out_path) + ".checkpoint.jsonl")
+    # Checked before any API call: a checkpoint from another --kind can't be resumed
+    try:
+        done = load_checkpoint(checkpoint_path, args.kind)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    school, client_id, secret = get_credentials()
+    vc = Veracross({
+        "school": school,
+        "client_id": client_id,
+        "client_secret": secret,
+        "scopes": SCOPES,
+        "max_workers": args.workers,
+    })
+
+    # 1) Every enrollment in the school, once
+    enrollments = vc.pull("non", "academics/enrollments", parallel=True)
+    if enrollments is None:
+        print("Could not pull enrollments.", file=sys.stderr)
+        return 1
+
+    # 2) Same academic-class filtering as the interactive page
+    pairs = []
+    person_of = {}
+    for item in enrollments:
+        pairs.append(item.get('id'))
+        pairs.append(item.get('class_description'))
+        person_of[item.get('id')] = item.get('person_id')
+    pairs = filter_pairs(pairs)
+    class_of = dict(zip(pairs[0::2], pairs[1::2]))
+    print(f"{len(class_of)} academic enrollments out of {len(enrollments)}.")
+
+    # 3) Fan out the report card calls, checkpointing each finished batch
+    todo = [enrollment_id for enrollment_id in class_of if enrollment_id not in done]
+    if done:
+        print(f"Resuming: {len(done)} enrollments already fetched, {len(todo)} to go.")
+
+    failed = []
+    with checkpoint_path.open("a", encoding="utf-8") as checkpoint:
+        for start in range(0, len(todo), args.batch):
+            batch = todo[start:start + args.batch]
+            results = vc.fetch_enrollment_grades(batch, args.kind, max_workers=args.workers)
+            for enrollment_id, grades in results.items():
+                if grades is None:
+                    failed.append(enrollment_id)
+                    continue
+                done[enrollment_id] = grades
+                checkpoint.write(json.dumps({"enrollment_id": enrollment_id, "kind": args.kind,
+                                             "grades": grades}) + "\n")
+            checkpoint.flush()
+            print(f"{len(done)}/{len(class_of)} enrollments fetched.")
+
+    if failed:
+        print(f"{len(failed)} enrollments failed; run again to retry them.", file=sys.stderr)
+        return 1
+
+    # 4) One consolidated table, built column-wise with the page's filtering rules
+    table = normalize_grades(done, class_of, args.kind, with_enrollment=True)
+    table.insert(1, "person_id", table["enrollment_id"].map(person_of))
+    if args.grading_period:
+        table = table[table["grading_period"] == args.grading_period]
+    table.to_csv(out_path, index=False, columns=["enrollment_id", "person_id"] + GRADE_COLUMNS[args.kind])
+    written = len(table)
+
+    checkpoint_path.unlink()
+    print(f"✅ Wrote {written} rows to {out_path}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,28 @@
-import streamlit as st
-import json, os
-from json import JSONDecodeError
-from pathlib import Path
-import pandas as pd
+from __future__ import annotations  # pandas type hints without importing pandas
+
+import hashlib
+import io
+import os
+import re
 import time
-from typing import Optional, Tuple
-from VCX import *
 from pathlib import Path
-import os, json
 
-import re
-import matplotlib.pyplot as plt
+import streamlit as st
+
+from roster import RosterRefresher, RosterStore, sync_roster
+from VCX import (AsyncVeracross, GradeTableCache, StackSampler, Trace, find_all_matches, find_any_id_by_item,
+                 get_credentials, load_env, normalize_grades, run_sync, shared_client, span)
+
+# pandas, matplotlib and yaml are imported where a phase first needs them, so
+# the login redirect, idle and error runs never pay for them. Credentials are
+# only read when the shared client is built.
+load_env()  # STUDENT_DB_PATH and friends may come from .env
 
 # ==============================
 # Utilities
 # ==============================
 
 
-from pathlib import Path
-
 def resolve_db_path() -> Path:
     # 1) Environment variable wins (recommended in Docker)
     env_path = os.getenv("STUDENT_DB_PATH")
@@ -45,21 +49,49 @@ def resolve_db_path() -> Path:
 DB_PATH = resolve_db_path()
 print(DB_PATH)
 
-def load_students():
-    if not DB_PATH.exists():
-        raise FileNotFoundError(f"Student DB not found at: {DB_PATH}")
-    with DB_PATH.open("r", encoding="utf-8") as f:
-        return json.load(f)
+# SQLite roster store; the old JSON dump is only read once to seed it
+STORE_PATH = Path(os.getenv("STUDENT_STORE_PATH") or DB_PATH.with_suffix(".sqlite"))
+
+@st.cache_resource(show_spinner=False)
+def load_students() -> RosterStore:
+    # One store per process, shared by every session (connections are per thread)
+    store = RosterStore(STORE_PATH)
+    if store.count() == 0 and DB_PATH.exists():
+        store.import_json(DB_PATH)
+    return store
+
+
+
+
+# Login config (same file log-in.py reads); used here for roles only
+CONFIG_PATH = Path(__file__).resolve().parents[1] / "data" / "config.yaml"
 
-def save_students(data):
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    tmp = DB_PATH.with_suffix(DB_PATH.suffix + ".tmp")
-    with tmp.open("w", encoding="utf-8") as f:
-        json.dump(data, f)  # same formatting as your prior call
-        f.flush()
-        os.fsync(f.fileno())
-    os.replace(tmp, DB_PATH)
+@st.cache_resource(show_spinner=False)
+def load_roles() -> dict:
+    # username -> role, e.g. {"jdoe": "admin"}
+    import yaml
+    try:
+        with open(CONFIG_PATH, "r") as f:
+            cfg = yaml.safe_load(f)
+        return {u: (info or {}).get("role", "") for u, info in cfg["credentials"]["usernames"].items()}
+    except Exception:
+        return {}
+
+def is_admin() -> bool:
+    roles = st.session_state.get("roles") or []
+    return "admin" in roles or load_roles().get(st.session_state.get("username")) == "admin"
+
+
+EMAIL_PATTERN = re.compile(r"[\w.+'-]+@[\w-]+(?:\.[\w-]+)+")
 
+def extract_emails(text: str) -> list:
+    # Every email in pasted text or an uploaded CSV/TXT, first occurrence order, no repeats
+    seen, emails = set(), []
+    for email in EMAIL_PATTERN.findall(text or ""):
+        if email.lower() not in seen:
+            seen.add(email.lower())
+            emails.append(email)
+    return emails
 
 
 def validate_email(email: str) -> bool:
@@ -77,6 +109,45 @@ def to_csv_bytes(df: pd.DataFrame) -> bytes:
     return df.to_csv(index=False).encode("utf-8")
 
 
+def pivot_hash(pivot: pd.DataFrame) -> str:
+    # Content hash of a class's pivot: values, periods and descriptions
+    import pandas as pd
+    h = hashlib.sha1(pd.util.hash_pandas_object(pivot.reset_index(), index=False).values.tobytes())
+    h.update("\x1f".join(map(str, pivot.columns)).encode("utf-8"))
+    return h.hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def class_chart_png(key: str, title: str, _pivot: pd.DataFrame) -> bytes:
+    # Cached by pivot hash (key); the figure is closed as soon as it is encoded
+    import matplotlib
+    matplotlib.use("Agg")  # render off-screen; figures are turned into PNGs
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 4.5))
+    try:
+        for desc in _pivot.columns:
+            ax.plot(
+                _pivot.index.astype(str),
+                _pivot[desc],
+                marker="o",
+                label=str(desc),
+            )
+        ax.set_xlabel("Grading Period")
+        ax.set_ylabel("Score")
+        ax.set_title(title)
+        ax.grid(True, linestyle="--", alpha=0.3)
+        # Force 0–5 scale regardless of data
+        ax.set_ylim(0.5, 5.5)
+        ax.set_yticks([1, 2, 3, 4, 5])
+        ax.legend(loc="best")
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", bbox_inches="tight")
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
+
+
 # ==============================
 # Session State Setup
 # ==============================
@@ -90,6 +161,9 @@ DEFAULT_STATE = {
     "show_confirm_update": False,  # show confirmation UI for DB update
     "is_updating": False,  # update in progress flag
     "last_updated": None,  # timestamp of last successful update
+    "last_sync_result": None,  # added / changed / removed counts of that update
+    "refresh_grades": False,  # skip the shared grade cache on the next pipeline run
+    "trace": None,  # timing spans of the current lookup
 }
 
 # 1) Gatekeeping: block unauthenticated access immediately
@@ -145,25 +219,70 @@ with h2:
         st.rerun()
 
 # Connection Credentials and VCX Building
-c = {
-    "school": credentials[0],
-    "client_id": credentials[1],
-    "client_secret": credentials[2],
-    "scopes": ['https://purl.imsglobal.org/spec/or/v1p1/scope/roster-core.readonly',
-               'https://purl.imsglobal.org/spec/or/v1p1/scope/roster.readonly', 'classes:list',
-               'academics.classes:list', 'academics.classes:read', 'academics.enrollments:list',
-               'academics.enrollments:read', 'classes:read', 'report_card.enrollments.qualitative_grades:list',
-               'report_card.enrollments.numeric_grades:list']
-}
+def client_config() -> dict:
+    # Read when the shared client is first built, not on every rerun
+    school, client_id, secret = get_credentials()
+    return {
+        "school": school,
+        "client_id": client_id,
+        "client_secret": secret,
+        "scopes": ['https://purl.imsglobal.org/spec/or/v1p1/scope/roster-core.readonly',
+                   'https://purl.imsglobal.org/spec/or/v1p1/scope/roster.readonly', 'classes:list',
+                   'academics.classes:list', 'academics.classes:read', 'academics.enrollments:list',
+                   'academics.enrollments:read', 'classes:read', 'report_card.enrollments.qualitative_grades:list',
+                   'report_card.enrollments.numeric_grades:list'],
+        # Interactive lookups: re-send a GET that has not answered in 3s
+        "hedge_after": 3,
+        # On-disk response cache next to the student database
+        "cache_path": str(DB_PATH.parent / "http_cache.sqlite"),
+    }
+
 endpointOne = "students"
 endpointTwo = "classes"
-vc = Veracross(c)
-student_list = []
+
+# Per-lookup stage timings, one JSON object per span
+TRACE_PATH = Path(os.getenv("VCX_TRACE_PATH") or DB_PATH.parent / "traces.jsonl")
+
+# Seconds between background roster syncs (0 turns the refresher off)
+REFRESH_SECONDS = int(os.getenv("ROSTER_REFRESH_SECONDS", "3600"))
+
+@st.cache_resource(show_spinner=False)
+def get_grade_cache() -> GradeTableCache:
+    # Processed grade tables shared by all sessions, keyed by (sourcedId, grade_mode, grading period)
+    return GradeTableCache(max_bytes=64 * 1024 * 1024, ttl=15 * 60)
+
+@st.cache_resource(show_spinner=False)
+def get_refresher() -> RosterRefresher:
+    # Started once per process; its client keeps tokens warm for every session's lookups
+    refresher = RosterRefresher(shared_client(client_config()), load_students(), interval=REFRESH_SECONDS or 3600)
+    # The listener runs on the refresher thread, which has no ScriptRunContext:
+    # hold on to the cache object itself instead of calling get_grade_cache() there
+    cache = get_grade_cache()
+
+    def drop_stale_grades(result):
+        if result["added"] + result["changed"] + result["removed"]:
+            cache.invalidate()
+
+    refresher.listeners.append(drop_stale_grades)
+    if REFRESH_SECONDS:
+        refresher.start()
+    return refresher
+
+vc = get_refresher().client
+avc = AsyncVeracross(vc)
+grade_cache = get_grade_cache()
 df = None
 
 # ---- Confirmation 'pop-up' (inline). If Streamlit >= 1.32, swap this for st.dialog(...). ----
 if st.session_state.show_confirm_update:
     st.warning("Are you sure you want to update the database file? Only choose this if new students have been admitted to the school.", icon="⚠️")
+    sync_mode = st.radio(
+        "Update mode",
+        options=["Changes only", "Full rebuild"],
+        horizontal=True,
+        help="'Changes only' fetches students modified since the last sync. 'Full rebuild' re-downloads the whole roster.",
+        key="sync_mode",
+    )
     c1, c2 = st.columns([1,1])
     with c1:
         if st.button("Yes, update now", key="confirm_update_yes"):
@@ -171,12 +290,14 @@ if st.session_state.show_confirm_update:
             st.session_state.show_confirm_update = False
             with st.spinner("Updating database..."):
                 try:
-                    num = 100
-                    student_list.append(vc.pull("oneRoster", endpointOne))
-                    student_list.append(vc.pull("oneRoster", endpointOne + "?offset=" + str(num)))
-                    student_list.append(vc.pull("oneRoster", endpointOne + "?offset=" + str(num + 100)))
-                    save_students(student_list)
+                    result = sync_roster(vc, load_students(), full=(sync_mode == "Full rebuild"),
+                                         endpoint=endpointOne)
+                    grade_cache.invalidate()
                     st.session_state.last_updated = time.strftime("%Y-%m-%d %H:%M:%S")
+                    st.session_state.last_sync_result = (
+                        f"{result['mode'].capitalize()} sync: {result['added']} added, "
+                        f"{result['changed']} changed, {result['removed']} removed."
+                    )
                     st.success(f"Database updated successfully at {st.session_state.last_updated}.")
                 except Exception as e:
                     st.error(f"Database update failed: {e}")
@@ -190,10 +311,40 @@ if st.session_state.show_confirm_update:
             st.rerun()
 
 student_list = load_students()
-
-# Show last updated timestamp if available
-if st.session_state.last_updated:
+if student_list.count() == 0:
+    st.info("The student database is empty. Use **Update database** to load the roster.")
+
+# Last sync by anyone (button or background refresher), shared through the store
+last_synced = student_list.get_meta("last_synced")
+if last_synced:
+    st.caption(f"Last database update: {last_synced}")
+elif st.session_state.last_updated:
     st.caption(f"Last database update: {st.session_state.last_updated}")
+if st.session_state.last_sync_result:
+    st.caption(st.session_state.last_sync_result)
+
+# ---- Type-ahead: search by name or partial email and pick the student directly ----
+search_query = st.text_input(
+    "Find a student",
+    key="student_search",
+    placeholder="Start typing a name or email",
+    help="Matches the start of an email or name, and tolerates typos.",
+)
+matches = student_list.search(search_query, limit=10) if search_query.strip() else []
+if matches:
+    picked = st.selectbox(
+        "Matching students",
+        options=matches,
+        format_func=lambda entry: entry[2],
+        key="student_pick",
+    )
+    if st.button("Look up this student", key="lookup_pick"):
+        # Already resolved to a sourcedId, so skip the email check
+        st.session_state.sourcedId = picked[0]
+        st.session_state.phase = "collecting"
+        st.session_state.error_msg = ""
+elif search_query.strip():
+    st.caption("No matching students.")
 
 with st.form("email_form", clear_on_submit=False):
     st.text_input(
@@ -233,12 +384,15 @@ if st.session_state.get("phase") == "checking":
         st.session_state.phase = "idle"
         st.session_state.sourcedId = None
         st.info("We couldn't find that email in the database. Please verify and try again.")
-        st.stop()  # stop this run cleanly
-
-    # found a match
-    st.session_state.sourcedId = found_id
-    st.session_state.phase = "collecting"
-    st.rerun()  # optional: jump straight to the next UI
+        suggestions = student_list.search(st.session_state.email, limit=5)
+        if suggestions:
+            st.caption("Did you mean: " + "; ".join(entry[2] for entry in suggestions)
+                       + "? Use **Find a student** above to pick one.")
+    else:
+        # found a match
+        st.session_state.sourcedId = found_id
+        st.session_state.phase = "collecting"
+        st.rerun()  # optional: jump straight to the next UI
 
 # --- elsewhere, guard before using the ID ---
 if st.session_state.get("phase") == "collecting":
@@ -252,258 +406,186 @@ writingSpace = st.empty()
 
 # Phase: collecting → run API pipeline
 if st.session_state.phase == "collecting":
+    # One trace per lookup, appended to TRACE_PATH; admins can also profile the next lookup
+    trace = Trace("student", TRACE_PATH, sourcedId=st.session_state.sourcedId, grade_mode=grade_mode)
+    st.session_state.trace = trace
+    sampler = StackSampler(include=("VCX.py", "app.py")).start() if st.session_state.get("profile_next") else None
+    lookup_started = time.perf_counter()
     with st.spinner("Running API pipeline and filtering data..."):
         try:
-            endpointThree = "students/" +  st.session_state.sourcedId + "/classes"
-            classes_data = vc.pull("oneRoster", endpointThree)
-            print("pulled classes data")
-            if classes_data is None:
-                # Force a clear error instead of a 'NoneType' crash
-                raise Exception(
-                    "The vc.pull() function returned None. This most likely indicates an API authorization failure (401 Error), an invalid endpoint, or empty data. Please check your API keys, scopes, and the 'endpointFour' variable.")
-
-            # Extract all veracrossId's from the data
-            veracrossId = find_all_matches(classes_data, "classes", "classCode")
-            print("pulled veracross data")
-
-            endpointFour = "students/" +  st.session_state.sourcedId
-            student_data = vc.pull("oneRoster", endpointFour)
-            print("pulled student data")
-
-            # Extract identifier which is the Veracross student ID number
-            studentId = student_data.get('user', {}).get('identifier', 'Not found')
-            print(studentId)
-
-            # Pull the enrollment data for the student using Veracross ID.
-            # This gives us the enrollment ids which we need for grade reports.
-            endpointFive = "academics/enrollments"
-            enrollments_data = vc.pull("non", endpointFive + "?person_id=" + studentId)
-
-            # Extracts enrollments Ids and class descriptions a list then filters non-academic classes.
-            enrollment_ids = []
-            for item in enrollments_data:
-                enrollment_ids.append(item.get('id'))
-                enrollment_ids.append(item.get('class_description'))
-            enrollment_ids = filter_pairs(enrollment_ids)
-
-            # insert condition - pull quantitative or qualitative depending on dropdown above
+            # Processed tables are shared across sessions; a repeat lookup skips the API
+            cache_key = (st.session_state.sourcedId, grade_mode, None)
+            refresh = st.session_state.refresh_grades
+            st.session_state.refresh_grades = False
+            with trace.span("grade_cache.get") as attrs:
+                df = None if refresh else grade_cache.get(cache_key)
+                attrs["hit"] = df is not None
+            if df is None:
+                # Classes + student run together, then enrollments, then all grade calls concurrently
+                st.session_state.grade_mode = grade_mode
+                grade_kind = "qualitative" if grade_mode == "Interims" else "numeric"
+
+                def show_progress(done, total, enrollment_id):
+                    left = total - done
+                    writingSpace.markdown(str(left) + " classes left to process." if left else "")
+
+                pipeline = run_sync(avc.student_pipeline(st.session_state.sourcedId, grade_kind,
+                                                         progress=show_progress, use_cache=not refresh,
+                                                         trace=trace))
+                classes_data = pipeline["classes"]
+                print("pulled classes data")
+                if classes_data is None:
+                    # Force a clear error instead of a 'NoneType' crash
+                    raise Exception(
+                        "The student's class list (OneRoster students/<sourcedId>/classes) came back empty. This most likely indicates an API authorization failure (401 Error), an invalid endpoint, or empty data. Please check your API keys, scopes, and the student_pipeline() endpoints in VCX.py.")
+
+                # Extract all veracrossId's from the data
+                veracrossId = find_all_matches({"classes": classes_data}, "classes", "classCode")
+                print("pulled veracross data")
+
+                student_data = pipeline["student"]
+                print("pulled student data")
+
+                # Extract identifier which is the Veracross student ID number
+                studentId = student_data.get('user', {}).get('identifier', 'Not found')
+                print(studentId)
+
+                # Enrollment ids and class descriptions as a flat list, non-academic classes filtered out.
+                enrollment_ids = pipeline["enrollment_ids"]
+                if enrollment_ids is None:
+                    raise Exception("Could not pull enrollments for student " + str(studentId) + ".")
+                grades = pipeline["grades"]
+
+                # One columnar pass over every class's report card records, filters included
+                with trace.span("normalize") as attrs:
+                    df = normalize_grades(grades, enrollment_ids, grade_kind)
+                    attrs["rows"] = len(df)
+                grade_cache.put(cache_key, df)
             st.session_state.grade_mode = grade_mode
-            if st.session_state.grade_mode == "Interims":
-                    # Pulls qualitative report card data and adds class descriptions to the lists
-                    # Counts down through the classes as it pulls data from each one
-                qualitative_data = []
-                for i in range(0, len(enrollment_ids), 2):
-                    endpointSix = "report_card/enrollments/" + str(enrollment_ids[i]) + "/qualitative_grades"
-                    qd = vc.pull("non", endpointSix)
-                    qualitative_data.append(qd)
-                    qualitative_data.append(enrollment_ids[i+1])
-                    writingSpace.markdown(str(int((len(enrollment_ids) - i)/2)) + " classes left to process.")
-                    if len(enrollment_ids) -i == 2:
-                        writingSpace.markdown("")
-
-                # Create an empty list to hold the processed data
-                processed_data = []
-                # Iterate through the main list using an index
-                # This allows us to look at the next item
-                for i in range(len(qualitative_data)):
-                    current_item = qualitative_data[i]
-
-                    # Check if the current item is a list (which might contain dicts)
-                    if isinstance(current_item, list):
-
-                        # The class name is the next item in the list
-                        class_name = None
-                        if (i + 1) < len(qualitative_data) and isinstance(qualitative_data[i + 1], str):
-                            class_name = qualitative_data[i + 1]
-
-                        # Iterate through the dictionaries in this list
-                        for item in current_item:
-                            # We must check if 'item' is a dictionary,
-                            # because the list could be empty (like at the start)
-                            if isinstance(item, dict):
-                                # Safely get the proficiency level abbreviation
-                                abbreviation = item.get('proficiency_level', {}).get('abbreviation')
-
-                                # Check if the abbreviation is NOT None (the filter)
-                                if abbreviation is not None:
-                                    # If it's not None, extract the required information
-                                    gp_abbr = item.get('grading_period', {}).get('abbreviation')
-                                    rc_desc = item.get('rubric_criteria', {}).get('description')
-
-                                    # Create a new dictionary with the extracted data
-                                    extracted_item = {
-                                        'class': class_name,  # The new field
-                                        'grading_period': gp_abbr,
-                                        'description': rc_desc,
-                                        'score': abbreviation
-                                    }
-
-                                    # Add this new dictionary to our processed list
-                                    processed_data.append(extracted_item)
-            elif st.session_state.grade_mode == "Numeric Grades":
-                quantitative_data = []
-                for i in range(0, len(enrollment_ids), 2):
-                    endpointSix = "report_card/enrollments/" + str(enrollment_ids[i]) + "/numeric_grades"
-                    qd = vc.pull("non", endpointSix)
-                    quantitative_data.append(qd)
-                    quantitative_data.append(enrollment_ids[i + 1])
-                    writingSpace.markdown(str(int((len(enrollment_ids) - i) / 2)) + " classes left to process.")
-                    if len(enrollment_ids) - i == 2:
-                        writingSpace.markdown("")
-
-                # Create an empty list to hold the processed data
-                processed_data = []
-                # Iterate through the main list using an index
-                # This allows us to look at the next item
-                for i in range(len(quantitative_data)):
-                    current_item = quantitative_data[i]
-
-                    # Check if the current item is a list (which might contain dicts)
-                    if isinstance(current_item, list):
-
-                        # The class name is the next item in the list
-                        class_name = None
-                        if (i + 1) < len(quantitative_data) and isinstance(quantitative_data[i + 1], str):
-                            class_name = quantitative_data[i + 1]
-                        for item in current_item:
-                            # We must check if 'item' is a dictionary,
-                            # because the list could be empty (like at the start)
-                            if isinstance(item, dict):
-                                # Safely get the proficiency level abbreviation
-                                abbreviation = item.get('posted_grade')
-
-                                # Check if the abbreviation is NOT None (the filter)
-                                if abbreviation != 0:
-                                    # If it's not None, extract the required information
-                                    gp_abbr = item.get('grading_period', {}).get('abbreviation')
-                                    rc_desc = item.get('grading_period', {}).get('description')
-                                    pg_lett = item.get('posted_letter_grade')
-
-                                    # Create a new dictionary with the extracted data
-                                    extracted_item = {
-                                        'class': class_name,  # The new field
-                                        'grading_period': gp_abbr,
-                                        'description': rc_desc,
-                                        'score': abbreviation,
-                                        'letter_grade': pg_lett
-                                    }
-
-                                    # Add this new dictionary to our processed list
-                                    processed_data.append(extracted_item)
-            else:
-                st.error("Choose a grade mode.")
-
-
-
-            # Creates the table with alignment for numeric columns and a different style
-            df = pd.DataFrame(processed_data)
             st.session_state.phase = "ready"
-            # table_md = tabulate(processed_data, headers="keys", tablefmt="pipe", colalign=("left", "center", "right"))
-            tab_table, tab_chart = st.tabs(["Table", "Charts"])
-            # view table with csv download option
-            with tab_table:
-                st.markdown("### Student Data Table")
-                st.dataframe(df)
-                csv_bytes = df.to_csv(index=False).encode("utf-8")
-
-                st.download_button(
-                    label="📥 Download as CSV",
-                    data=csv_bytes,
-                    file_name="student_data.csv",
-                    mime="text/csv"
+            st.session_state.df = df
+        except Exception as e:
+            st.session_state.error_msg = f"Something went wrong while fetching data: {e}"
+            st.session_state.phase = "error"
+    trace.add("lookup", lookup_started, time.perf_counter() - lookup_started, outcome=st.session_state.phase)
+    if sampler is not None:
+        sampler.stop()
+        st.session_state.profile_next = False
+        st.session_state.last_profile = sampler
+
+# Phase: ready → show the table and charts (also on reruns from downloads and buttons)
+if st.session_state.phase == "ready":
+    import pandas as pd
+    df = st.session_state.df
+    try:
+        # table_md = tabulate(processed_data, headers="keys", tablefmt="pipe", colalign=("left", "center", "right"))
+        tab_table, tab_chart = st.tabs(["Table", "Charts"])
+        # view table with csv download option
+        with tab_table:
+            st.markdown("### Student Data Table")
+            st.dataframe(df)
+            csv_bytes = df.to_csv(index=False).encode("utf-8")
+
+            st.download_button(
+                label="📥 Download as CSV",
+                data=csv_bytes,
+                file_name="student_data.csv",
+                mime="text/csv"
+            )
+        if st.session_state.grade_mode == "Interims":
+            # Data Visualization
+            with tab_chart:
+                st.caption("Charts for interim scores for each class.")
+
+                # --- Prep + ordering ---
+                f = df.copy()
+                f["grading_period"] = f["grading_period"].astype(str)
+                f["score"] = pd.to_numeric(f["score"], errors="coerce")
+
+                def _period_num(s: str) -> int:
+                    m = re.search(r"(\d+)$", s or "")
+                    return int(m.group(1)) if m else 9999
+
+                ordered_periods = sorted(f["grading_period"].dropna().unique(), key=_period_num)
+                f["grading_period"] = pd.Categorical(
+                    f["grading_period"], categories=ordered_periods, ordered=True
                 )
-            if st.session_state.grade_mode == "Interims":
-                # Data Visualization
-                with tab_chart:
-                    st.caption("Charts for interim scores for each class.")
-
-                    # --- Prep + ordering ---
-                    f = df.copy()
-                    f["grading_period"] = f["grading_period"].astype(str)
-                    f["score"] = pd.to_numeric(f["score"], errors="coerce")
-
-                    def _period_num(s: str) -> int:
-                        m = re.search(r"(\d+)$", s or "")
-                        return int(m.group(1)) if m else 9999
-
-                    ordered_periods = sorted(f["grading_period"].dropna().unique(), key=_period_num)
-                    f["grading_period"] = pd.Categorical(
-                        f["grading_period"], categories=ordered_periods, ordered=True
-                    )
-
-                    classes = sorted(f["class"].dropna().unique())
-                    descriptions = sorted(f["description"].dropna().unique())
-
-                    if f.empty or not classes:
-                        st.info("No data available to plot.")
-                        st.stop()
-
-                    # --- One tab per class ---
-                    tabs = st.tabs(classes)
-                    for tab, cls in zip(tabs, classes):
-                        with tab:
-                            st.subheader(cls)
 
-                            sub = f[f["class"] == cls]
-                            if sub.empty:
-                                st.write("No rows for this class.")
-                                continue
-
-                            # Pivot: rows = grading_period, columns = description, values = score
+                classes = sorted(f["class"].dropna().unique())
+                descriptions = sorted(f["description"].dropna().unique())
+
+                if f.empty or not classes:
+                    st.info("No data available to plot.")
+                else:
+                    # --- Only the selected class is pivoted and drawn ---
+                    pick, style = st.columns([2, 1])
+                    with pick:
+                        cls = st.selectbox("Class", options=classes, key="chart_class")
+                    with style:
+                        chart_style = st.radio(
+                            "Chart style",
+                            options=["Matplotlib", "Native"],
+                            horizontal=True,
+                            key="chart_style",
+                            help="'Native' draws an interactive Streamlit chart and skips matplotlib.",
+                        )
+                    st.subheader(cls)
+
+                    sub = f[f["class"] == cls]
+                    if sub.empty:
+                        st.write("No rows for this class.")
+                    else:
+                        # Pivot: rows = grading_period, columns = description, values = score
+                        with span(st.session_state.trace, "chart.pivot", class_name=cls):
                             pivot = (
                                 sub.pivot_table(
                                     index="grading_period",
                                     columns="description",
                                     values="score",
                                     aggfunc="mean",  # use 'first' if each combo is unique
+                                    observed=True,
                                 )
                                 .sort_index()
                             )
 
-                            # Download CSV for this class
-                            csv_bytes = pivot.reset_index().to_csv(index=False).encode("utf-8")
-                            st.download_button(
-                                label=f"📥 Download {cls} data (CSV)",
-                                data=csv_bytes,
-                                file_name=f"{cls.replace(' ', '_').lower()}_trends.csv",
-                                mime="text/csv",
-                                key=f"dl_{cls}"
-                            )
-
-                            # Plot: one figure per class; no subplots, no explicit colors
-                            fig, ax = plt.subplots(figsize=(8, 4.5))
-                            for desc in pivot.columns:
-                                ax.plot(
-                                    pivot.index.astype(str),
-                                    pivot[desc],
-                                    marker="o",
-                                    label=str(desc),
-                                )
-                            ax.set_xlabel("Grading Period")
-                            ax.set_ylabel("Score")
-                            ax.set_title(f"{cls} — Scores by Description")
-                            ax.grid(True, linestyle="--", alpha=0.3)
-                            # Force 0–5 scale regardless of data
-                            ax.set_ylim(0.5, 5.5)
-                            ax.set_yticks([1, 2, 3, 4, 5])
-                            ax.legend(loc="best")
-                            st.pyplot(fig)
-
-                            with st.expander("Show rows for this class"):
-                                st.dataframe(sub.sort_values(["grading_period", "description"]))
-
-            st.divider()
-            left, right = st.columns([1, 1])
-            with left:
-                if st.button("🔁 New lookup"):
-                    reset_for_new_lookup()
-                    st.rerun()
-            with right:
-                st.caption("Tip: Use the **New lookup** button to start fresh.")
-
-        except Exception as e:
-            st.session_state.error_msg = f"Something went wrong while fetching data: {e}"
-            st.session_state.phase = "error"
+                        # Download CSV for this class
+                        csv_bytes = pivot.reset_index().to_csv(index=False).encode("utf-8")
+                        st.download_button(
+                            label=f"📥 Download {cls} data (CSV)",
+                            data=csv_bytes,
+                            file_name=f"{cls.replace(' ', '_').lower()}_trends.csv",
+                            mime="text/csv",
+                            key=f"dl_{cls}"
+                        )
+
+                        with span(st.session_state.trace, "chart.render", class_name=cls, style=chart_style):
+                            if chart_style == "Native":
+                                native = pivot.copy()
+                                native.index = native.index.astype(str)
+                                st.line_chart(native, x_label="Grading Period", y_label="Score")
+                            else:
+                                st.image(class_chart_png(pivot_hash(pivot), f"{cls} — Scores by Description", pivot))
+
+                        with st.expander("Show rows for this class"):
+                            st.dataframe(sub.sort_values(["grading_period", "description"]))
+
+        st.divider()
+        left, right = st.columns([1, 1])
+        with left:
+            if st.button("🔁 New lookup"):
+                reset_for_new_lookup()
+                st.rerun()
+            if st.button("🔄 Refresh grades", help="Fetch this student's grades again instead of using the saved copy."):
+                grade_cache.invalidate(st.session_state.sourcedId)
+                st.session_state.refresh_grades = True
+                st.session_state.phase = "collecting"
+                st.rerun()
+        with right:
+            st.caption("Tip: Use the **New lookup** button to start fresh.")
+
+    except Exception as e:
+        st.session_state.error_msg = f"Something went wrong while displaying data: {e}"
+        st.session_state.phase = "error"
 
 # Phase: error → show message
 if st.session_state.phase == "error":
@@ -514,4 +596,156 @@ if st.session_state.phase == "error":
 
 # Idle (first load or after editing email)
 if st.session_state.phase == "idle":
-    st.info("Enter an email above and click **Submit** to begin.")
\ No newline at end of file
+    st.info("Enter an email above and click **Submit** to begin.")
+
+# ---- Batch lookup: a whole advisory group at once ----
+with st.expander("👥 Batch lookup (several students)"):
+    with st.form("batch_form", clear_on_submit=False):
+        batch_text = st.text_area("Paste emails", placeholder="One per line, or separated by commas or spaces")
+        batch_file = st.file_uploader("…or upload a CSV / text file with emails", type=["csv", "txt"])
+        batch_mode = st.selectbox("What would you like to view?", options=["Interims", "Numeric Grades"],
+                                  key="batch_grade_mode")
+        batch_submitted = st.form_submit_button("Run batch", type="primary")
+
+    if batch_submitted:
+        text = batch_text or ""
+        if batch_file is not None:
+            text += "\n" + batch_file.getvalue().decode("utf-8", errors="replace")
+        emails = extract_emails(text)
+        batch_kind = "qualitative" if batch_mode == "Interims" else "numeric"
+
+        # 1) Resolve every email in one pass
+        resolved = student_list.find_many("email", emails)
+        status = {email: ("not in database" if email not in resolved else "queued") for email in emails}
+        tables = {}
+
+        # 2) Students with a shared cached table skip the API
+        for email, sourced_id in resolved.items():
+            cached = grade_cache.get((sourced_id, batch_mode, None))
+            if cached is not None:
+                tables[email] = cached
+                status[email] = "done (cached)"
+
+        todo = {sourced_id: email for email, sourced_id in resolved.items() if email not in tables}
+        progress_bar = st.progress(0.0, text=f"0 of {len(todo)} students fetched")
+        status_table = st.empty()
+
+        def show_status():
+            status_table.dataframe([{"email": e, "status": s} for e, s in status.items()], hide_index=True)
+
+        def on_student(sourced_id, pipeline, error):
+            email = todo[sourced_id]
+            if error is None and (pipeline["student"] is None or pipeline["enrollment_ids"] is None):
+                error = "could not pull the student or their enrollments"
+            if error is None:
+                try:
+                    table = normalize_grades(pipeline["grades"], pipeline["enrollment_ids"], batch_kind)
+                except Exception as e:
+                    error = e
+            if error is None:
+                grade_cache.put((sourced_id, batch_mode, None), table)
+                tables[email] = table
+                failed = sum(1 for grades in pipeline["grades"].values() if grades is None)
+                status[email] = f"done, {failed} classes failed" if failed else "done"
+            else:
+                status[email] = f"error: {error}"
+            finished = sum(1 for e in todo.values() if not status[e].startswith("queued"))
+            progress_bar.progress(finished / len(todo), text=f"{finished} of {len(todo)} students fetched")
+            show_status()
+
+        show_status()
+        # 3) All pipelines at once; they share the client's concurrency limit and rate limiter
+        if todo:
+            run_sync(avc.student_pipelines(list(todo), batch_kind, progress=on_student))
+
+        import pandas as pd
+        frames = [table.assign(email=email) for email, table in tables.items() if len(table)]
+        combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if len(combined):
+            combined = combined[["email"] + [col for col in combined.columns if col != "email"]]
+        st.session_state.batch_df = combined
+        st.session_state.batch_status = status
+
+    if st.session_state.get("batch_status"):
+        status = st.session_state.batch_status
+        problems = {e: s for e, s in status.items() if not s.startswith("done")}
+        st.caption(f"{len(status) - len(problems)} of {len(status)} students done.")
+        if problems:
+            st.warning("\n".join(f"- {e}: {s}" for e, s in problems.items()))
+        combined = st.session_state.get("batch_df")
+        if combined is not None and len(combined):
+            st.dataframe(combined, hide_index=True)
+            st.download_button(
+                label="📥 Download batch as CSV",
+                data=combined.to_csv(index=False).encode("utf-8"),
+                file_name="batch_student_data.csv",
+                mime="text/csv",
+                key="dl_batch",
+            )
+
+# ---- Admin only: request metrics for this process's Veracross client ----
+if is_admin():
+    import pandas as pd
+    with st.expander("📈 API metrics (admin)"):
+        snap = vc.metrics.snapshot()
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Rate limit left", snap["rate_limit_remaining"] if snap["rate_limit_remaining"] is not None else "—")
+        m2.metric("Rate limiter waits", f"{snap['rate_limit_waits']} ({snap['rate_limit_sleep_seconds']:.1f}s)")
+        m3.metric("Retries", f"{snap['retries']} ({snap['retry_sleep_seconds']:.1f}s)")
+        m4.metric("Token refreshes", sum(snap["token_refreshes"].values()))
+
+        rows = [{
+            "endpoint": template,
+            "requests": e["requests"],
+            "statuses": ", ".join(f"{code}: {n}" for code, n in sorted(e["statuses"].items())),
+            "mean ms": round(e["mean_seconds"] * 1000, 1) if e["mean_seconds"] is not None else None,
+            "p95 ≤ s": e["p95_seconds"],
+            "pages": e["pages"],
+            "records": e["records"],
+            "KB": round(e["bytes"] / 1024, 1),
+        } for template, e in sorted(snap["endpoints"].items())]
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True)
+        else:
+            st.caption("No API requests yet in this process.")
+        if vc.cache is not None:
+            st.caption(f"Response cache: {vc.cache_stats()}")
+
+        st.download_button(
+            label="📥 Prometheus metrics",
+            data=vc.metrics.prometheus().encode("utf-8"),
+            file_name="vcx_metrics.prom",
+            mime="text/plain",
+            key="dl_metrics",
+        )
+
+    with st.expander("⏱️ Lookup traces and profiling (admin)"):
+        if st.session_state.trace is not None:
+            st.caption(f"Stages of the last lookup (trace {st.session_state.trace.trace_id}):")
+            spans = pd.DataFrame(st.session_state.trace.summary())
+            st.dataframe(spans.drop(columns=["trace", "lookup", "time"], errors="ignore"), hide_index=True)
+        if TRACE_PATH.exists():
+            st.download_button(
+                label="📥 All traces (JSON lines)",
+                data=TRACE_PATH.read_bytes(),
+                file_name=TRACE_PATH.name,
+                mime="application/x-ndjson",
+                key="dl_traces",
+            )
+
+        st.checkbox(
+            "Profile the next lookup",
+            key="profile_next",
+            help="Samples every thread's stack while the next lookup runs. Adds a little overhead.",
+        )
+        profile = st.session_state.get("last_profile")
+        if profile is not None:
+            st.caption(f"Last profile: {profile.samples} samples over {profile.seconds:.2f}s. Busiest functions:")
+            st.dataframe(pd.DataFrame(profile.top(15), columns=["function", "samples"]), hide_index=True)
+            st.download_button(
+                label="📥 Profile (collapsed stacks for speedscope / flamegraph.pl)",
+                data=profile.collapsed().encode("utf-8"),
+                file_name="lookup_profile.txt",
+                mime="text/plain",
+                key="dl_profile",
+            )
@@ -0,0 +1,629 @@
+# roster.py
+# Local copy of the OneRoster student directory and fast lookups over it.
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def _norm(value):
+    """
+    Lookup key: emails and ids are compared case-insensitively.
+    """
+    return str(value).strip().lower()
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    Type-ahead index over a list of OneRoster users.
+
+    Prefix matches come from a sorted array of search keys (email, "given
+    family", "family given", identifier) and a binary search; fuzzy matches
+    from a trigram index over the names and the local part of the email, so
+    a typo or a partial name still finds the student. Entries are
+    (sourcedId, email, label) tuples.
+    """
+
+    def __init__(self, users):
+        """
+        :param users: user dicts or RosterRecords
+        """
+        self.entries = []
+        keys = []
+        self.trigrams = {}
+        for user in users:
+            if not isinstance(user, (dict, RosterRecord)) or not user.get("sourcedId"):
+                continue
+            given = (user.get("givenName") or "").strip()
+            family = (user.get("familyName") or "").strip()
+            email = (user.get("email") or "").strip()
+            name = ", ".join(part for part in (family, given) if part)
+            label = f"{name} <{email}>" if name and email else (name or email or user.get("sourcedId"))
+            position = len(self.entries)
+            self.entries.append((user.get("sourcedId"), email, label))
+
+            fuzzy = {_norm(email.split("@")[0])} if email else set()
+            for key in (email, f"{given} {family}", f"{family} {given}", user.get("identifier")):
+                key = _norm(key or "")
+                if key:
+                    keys.append((key, position))
+            for key in (given, family, f"{given} {family}"):
+                key = _norm(key)
+                if key:
+                    fuzzy.add(key)
+            for key in fuzzy:
+                for gram in _trigrams(key):
+                    self.trigrams.setdefault(gram, set()).add(position)
+
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.positions = array("I", [position for _, position in keys])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def prefix(self, query, limit=10):
+        """
+        :return: entries with a search key starting with query, in key order
+        """
+        query = _norm(query)
+        found = []
+        if not query:
+            return found
+        seen = set()
+        i = bisect_left(self.keys, query)
+        while i < len(self.keys) and self.keys[i].startswith(query) and len(found) < limit:
+            position = self.positions[i]
+            if position not in seen:
+                seen.add(position)
+                found.append(self.entries[position])
+            i += 1
+        return found
+
+    def fuzzy(self, query, limit=10, threshold=0.3):
+        """
+        :param threshold: share of the query's trigrams an entry must contain
+        :return: entries ranked by trigram overlap with query
+        """
+        grams = _trigrams(_norm(query))
+        shared = {}
+        for gram in grams:
+            for position in self.trigrams.get(gram, ()):
+                shared[position] = shared.get(position, 0) + 1
+        minimum = threshold * len(grams)
+        ranked = sorted((position for position, count in shared.items() if count >= minimum),
+                        key=lambda position: (-shared[position], self.entries[position][2]))
+        return [self.entries[position] for position in ranked[:limit]]
+
+    def search(self, query, limit=10):
+        """
+        Prefix matches first, then fuzzy matches to fill up to limit.
+        :return: list of (sourcedId, email, label)
+        """
+        if not query or not query.strip():
+            return []
+        found = self.prefix(query, limit)
+        if len(found) < limit:
+            seen = {entry[0] for entry in found}
+            for entry in self.fuzzy(query, limit):
+                if entry[0] not in seen:
+                    found.append(entry)
+                    if len(found) == limit:
+                        break
+        return found
+
+
+def _user_dicts(data):
+    """
+    Users out of one {'users': [...]} container or a list of them.
+    """
+    if isinstance(data, dict):
+        containers = [data]
+    elif isinstance(data, list):
+        containers = [d for d in data if isinstance(d, dict)]
+    else:
+        containers = []
+    return [user for container in containers
+            for user in (container.get('users') or []) if isinstance(user, dict)]
+
+
+class RosterRecord:
+    """
+    The few user fields the app needs, without the rest of the OneRoster
+    object (orgs, agents, grades, metadata). Names and roles repeat across a
+    school, so they are interned and shared between records.
+    """
+
+    FIELDS = ("sourcedId", "email", "identifier", "givenName", "familyName", "role")
+    INTERNED = ("givenName", "familyName", "role")
+    __slots__ = FIELDS
+
+    def __init__(self, sourcedId=None, email=None, identifier=None, givenName=None, familyName=None, role=None):
+        self.sourcedId = sourcedId
+        self.email = email
+        self.identifier = identifier
+        self.givenName = givenName
+        self.familyName = familyName
+        self.role = role
+
+    @classmethod
+    def from_user(cls, user):
+        values = {}
+        for field in cls.FIELDS:
+            value = user.get(field)
+            if value is not None:
+                value = str(value)
+                if field in cls.INTERNED:
+                    value = sys.intern(value)
+            values[field] = value
+        return cls(**values)
+
+    def get(self, field, default=None):
+        """
+        dict-style access, so records work wherever user dicts did.
+        """
+        value = getattr(self, field, None) if field in self.FIELDS else None
+        return default if value is None else value
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+
+    def __repr__(self):
+        return f"RosterRecord({self.to_dict()!r})"
+
+
+class RosterStore:
+    """
+    SQLite store for the OneRoster users (and optionally classes and
+    enrollments). Lookup columns are indexed, the database runs in WAL mode so
+    sessions keep reading while a refresh writes, and writes are upserts in a
+    single transaction.
+
+    Each thread gets its own connection, so one store can be shared across
+    Streamlit sessions.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            sourcedId TEXT PRIMARY KEY,
+            email TEXT COLLATE NOCASE,
+            identifier TEXT COLLATE NOCASE,
+            role TEXT,
+            status TEXT,
+            dateLastModified TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS users_email ON users (email);
+        CREATE INDEX IF NOT EXISTS users_identifier ON users (identifier);
+        CREATE INDEX IF NOT EXISTS users_role ON users (role);
+        CREATE TABLE IF NOT EXISTS classes (
+            sourcedId TEXT PRIMARY KEY,
+            classCode TEXT,
+            title TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS enrollments (
+            sourcedId TEXT PRIMARY KEY,
+            user_sourcedId TEXT,
+            class_sourcedId TEXT,
+            role TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS enrollments_user ON enrollments (user_sourcedId);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    # Columns find() can use without decoding every row
+    USER_COLUMNS = ("sourcedId", "email", "identifier", "role", "status", "dateLastModified")
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._search = None
+        self._search_lock = threading.Lock()
+        with self.transaction() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(self.SCHEMA)
+
+    def connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(str(self.path), timeout=30)
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commit on success, roll back on error. Reads inside one transaction
+        see a consistent snapshot.
+        """
+        db = self.connect()
+        with db:
+            yield db
+
+    # ---- writes ----
+
+    @staticmethod
+    def _user_row(user):
+        return (user.get("sourcedId"), user.get("email"), user.get("identifier"), user.get("role"),
+                user.get("status"), user.get("dateLastModified"), json.dumps(user))
+
+    def upsert_users(self, users, db=None):
+        """
+        Insert or update users by sourcedId.
+        :return: int: number of users written
+        """
+        rows = [self._user_row(u) for u in users if isinstance(u, dict) and u.get("sourcedId")]
+        sql = """
+            INSERT INTO users (sourcedId, email, identifier, role, status, dateLastModified, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(sourcedId) DO UPDATE SET
+                email = excluded.email, identifier = excluded.identifier, role = excluded.role,
+                status = excluded.status, dateLastModified = excluded.dateLastModified,
+                data = excluded.data
+        """
+        if db is not None:
+            db.executemany(sql, rows)
+        else:
+            with self.transaction() as db:
+                db.executemany(sql, rows)
+        return len(rows)
+
+    def replace_users(self, users):
+        """
+        Full refresh: upsert every user and drop the ones no longer present.
+        """
+        users = [u for u in users if isinstance(u, dict) and u.get("sourcedId")]
+        self.merge_users(users, prune=True)
+        return len(users)
+
+    def merge_users(self, users, prune=False):
+        """
+        Apply a batch of changed users in one transaction. Users with
+        status "tobedeleted" are removed (OneRoster tombstones).
+        :param prune: also remove every user not in the batch (full refresh)
+        :return: dict with added / changed / removed counts
+        """
+        counts = {"added": 0, "changed": 0, "removed": 0}
+        users = [u for u in users if isinstance(u, dict) and u.get("sourcedId")]
+        with self.transaction() as db:
+            # Only the stored rows this batch touches, 500 ids per query
+            ids = list({u["sourcedId"] for u in users})
+            existing = {}
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                existing.update(db.execute(
+                    f"SELECT sourcedId, data FROM users WHERE sourcedId IN ({','.join('?' * len(chunk))})", chunk))
+            upserts, deletes = [], set()
+            for user in users:
+                sourced_id = user["sourcedId"]
+                if user.get("status") == "tobedeleted":
+                    if sourced_id in existing:
+                        deletes.add(sourced_id)
+                    continue
+                data = json.dumps(user)
+                if sourced_id not in existing:
+                    counts["added"] += 1
+                elif existing[sourced_id] != data:
+                    counts["changed"] += 1
+                else:
+                    continue
+                upserts.append(user)
+
+            if prune:
+                seen = {u["sourcedId"] for u in users if u.get("status") != "tobedeleted"}
+                stored = {row[0] for row in db.execute("SELECT sourcedId FROM users")}
+                deletes.update(stored - seen)
+
+            self.upsert_users(upserts, db)
+            db.executemany("DELETE FROM users WHERE sourcedId = ?", [(i,) for i in deletes])
+            counts["removed"] = len(deletes)
+        return counts
+
+    def upsert_classes(self, classes):
+        rows = [(c.get("sourcedId"), c.get("classCode"), c.get("title"), json.dumps(c))
+                for c in classes if isinstance(c, dict) and c.get("sourcedId")]
+        with self.transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO classes VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def upsert_enrollments(self, enrollments):
+        rows = [(e.get("sourcedId"), (e.get("user") or {}).get("sourcedId"),
+                 (e.get("class") or {}).get("sourcedId"), e.get("role"), json.dumps(e))
+                for e in enrollments if isinstance(e, dict) and e.get("sourcedId")]
+        with self.transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO enrollments VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def import_json(self, path):
+        """
+        One-time migration from the old student_list.json page dump.
+        """
+        with Path(path).open("r", encoding="utf-8") as f:
+            return self.replace_users(_user_dicts(json.load(f)))
+
+    # ---- reads ----
+
+    def get_user(self, field, value):
+        """
+        :return: the user dict whose field matches value (case-insensitive
+                 for email and identifier), or None
+        """
+        if field not in self.USER_COLUMNS or value is None:
+            return None
+        row = self.connect().execute(f"SELECT data FROM users WHERE {field} = ? LIMIT 1",
+                                     (str(value).strip(),)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def find(self, item_to_find, to_find, to_return):
+        """
+        Same contract as find_any_id_by_item, so the store can be passed to it.
+        """
+        if to_return in self.USER_COLUMNS and item_to_find in self.USER_COLUMNS and to_find is not None:
+            row = self.connect().execute(
+                f"SELECT {to_return} FROM users WHERE {item_to_find} = ? LIMIT 1",
+                (str(to_find).strip(),)).fetchone()
+            return row[0] if row else None
+        user = self.get_user(item_to_find, to_find)
+        return user.get(to_return) if user is not None else None
+
+    def find_many(self, item_to_find, values, to_return="sourcedId"):
+        """
+        Batch form of find(): resolve many values (e.g. a pasted list of
+        emails) with one query per 500 values instead of one per value.
+        :return: dict of value (as given) -> to_return, for the values that matched
+        """
+        if item_to_find not in self.USER_COLUMNS or to_return not in self.USER_COLUMNS:
+            raise ValueError(f"find_many needs user columns, got {item_to_find!r} and {to_return!r}")
+        # email and identifier compare case-insensitively (COLLATE NOCASE)
+        key = _norm if item_to_find in ("email", "identifier") else (lambda v: str(v).strip())
+        wanted = [str(v).strip() for v in values if v is not None and str(v).strip()]
+        found = {}
+        for start in range(0, len(wanted), 500):
+            chunk = wanted[start:start + 500]
+            rows = self.connect().execute(
+                f"SELECT {item_to_find}, {to_return} FROM users WHERE {item_to_find} IN ({','.join('?' * len(chunk))})",
+                chunk)
+            for match, result in rows:
+                found.setdefault(key(match), result)
+        return {v: found[key(v)] for v in values if v is not None and key(v) in found}
+
+    def users(self, role=None):
+        """
+        :return: list of user dicts, optionally only one role
+        """
+        if role:
+            rows = self.connect().execute("SELECT data FROM users WHERE role = ?", (role,))
+        else:
+            rows = self.connect().execute("SELECT data FROM users")
+        return [json.loads(row["data"]) for row in rows]
+
+    def records(self, role=None):
+        """
+        :return: list of compact RosterRecords, read without decoding whole user objects
+        """
+        sql = """
+            SELECT sourcedId, email, identifier, json_extract(data, '$.givenName'),
+                   json_extract(data, '$.familyName'), role
+            FROM users
+        """
+        if role:
+            rows = self.connect().execute(sql + " WHERE role = ?", (role,))
+        else:
+            rows = self.connect().execute(sql)
+        return [RosterRecord.from_user(dict(zip(RosterRecord.FIELDS, row))) for row in rows]
+
+    def count(self):
+        return self.connect().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def search_index(self):
+        """
+        SearchIndex over the stored users. It is rebuilt only when the user
+        count, the newest dateLastModified or the last sync time changes, so
+        a sync from another process is picked up on the next call.
+        """
+        db = self.connect()
+        version = tuple(db.execute("SELECT COUNT(*), MAX(dateLastModified) FROM users").fetchone())
+        version += (self.get_meta("last_synced"),)
+        with self._search_lock:
+            if self._search is None or self._search[0] != version:
+                self._search = (version, SearchIndex(self.records()))
+            return self._search[1]
+
+    def search(self, query, limit=10):
+        """
+        Type-ahead lookup by email, name or identifier, tolerant of typos.
+        :return: list of (sourcedId, email, label)
+        """
+        return self.search_index().search(query, limit)
+
+    def __len__(self):
+        return self.count()
+
+    # ---- meta ----
+
+    def get_meta(self, key, default=None):
+        row = self.connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+
+def sync_roster(vc, store, full=False, endpoint="students"):
+    """
+    Bring the store up to date with OneRoster.
+
+    Incremental mode asks only for users modified after the stored high-water
+    mark (dateLastModified) and merges them, applying tombstones. Full mode,
+    or the first sync, pulls everyone and drops users that disappeared.
+    :param vc: Veracross client
+    :param store: RosterStore
+    :return: dict with mode, added / changed / removed counts and the new high-water mark.
+             Raises RuntimeError if the pull failed.
+    """
+    mark = store.get_meta("users_high_water")
+    full = full or not mark or store.count() == 0
+
+    if full:
+        users = vc.pull("oneRoster", endpoint, use_cache=False)
+    else:
+        users = vc.pull("oneRoster", endpoint, {"filter": f"dateLastModified>'{mark}'"}, use_cache=False)
+    if users is None:
+        raise RuntimeError(f"The {endpoint} roster pull failed.")
+
+    counts = store.merge_users(users, prune=full)
+
+    # ISO 8601 timestamps sort as strings
+    stamps = [u.get("dateLastModified") for u in users if isinstance(u, dict) and u.get("dateLastModified")]
+    if stamps:
+        mark = max([mark] + stamps if mark else stamps)
+        store.set_meta("users_high_water", mark)
+    store.set_meta("last_synced", time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    counts.update(mode="full" if full else "incremental", high_water=mark)
+    return counts
+
+
+class RosterRefresher:
+    """
+    Background thread that keeps the roster store and the client's bearer
+    tokens warm, so the first lookup after a deploy or a token expiry does
+    not pay for them. Each sync writes "last_synced" to the store's meta
+    table, which every session (and process) can read.
+    """
+
+    def __init__(self, vc, store, interval=3600, token_interval=300):
+        self.client = vc
+        self.store = store
+        # Seconds between roster syncs; tokens are checked every token_interval
+        self.interval = interval
+        self.token_interval = token_interval
+        # Make the next scheduled sync a full rebuild
+        self.full_next = False
+        # Called with the result after every successful sync (e.g. to drop cached grade tables)
+        self.listeners = []
+        self.last_result = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the worker thread (once; later calls are no-ops).
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="roster-refresher", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def warm_tokens(self):
+        """
+        Fetch a new token for each scope set that would expire before the
+        next check. Scope sets the client has no scopes for are skipped.
+        """
+        for scope_set in ("v3", "oneRoster"):
+            if not self.client.scope_sets.get(scope_set):
+                continue
+            if self.client.tokens.expires_in(scope_set) < self.token_interval + self.client.tokens.refresh_margin:
+                self.client.get_authorization_token(scope_set, force=True)
+
+    def sync(self, full=False):
+        """
+        Run one roster sync now.
+        :return: the sync_roster result dict
+        """
+        try:
+            self.last_result = sync_roster(self.client, self.store, full=full)
+            self.last_error = None
+            for listener in self.listeners:
+                listener(self.last_result)
+        except Exception as e:
+            self.last_error = f"{time.strftime('%Y-%m-%d %H:%M:%S')}: {e}"
+            raise
+        return self.last_result
+
+    def _run(self):
+        next_sync = 0.0
+        while not self._stop.is_set():
+            try:
+                self.warm_tokens()
+                if time.time() >= next_sync:
+                    next_sync = time.time() + self.interval
+                    full, self.full_next = self.full_next, False
+                    self.sync(full=full)
+            except Exception as e:
+                print(f"roster refresher: {e}", file=sys.stderr)
+            self._stop.wait(min(self.token_interval, max(1.0, next_sync - time.time())))
+
+
+ROSTER_SCOPES = ['https://purl.imsglobal.org/spec/or/v1p1/scope/roster-core.readonly',
+                 'https://purl.imsglobal.org/spec/or/v1p1/scope/roster.readonly']
+
+
+def main():
+    import argparse
+    from VCX import Veracross, get_credentials
+
+    parser = argparse.ArgumentParser(description="Sync the local student roster from OneRoster.")
+    parser.add_argument("command", choices=["sync", "daemon"],
+                        help="sync once, or keep syncing on a schedule")
+    parser.add_argument("--store", default=os.getenv("STUDENT_STORE_PATH", "data/student_list.sqlite"),
+                        help="SQLite roster store")
+    parser.add_argument("--full", action="store_true", help="full rebuild instead of changes only")
+    parser.add_argument("--interval", type=int, default=3600, help="daemon: seconds between syncs")
+    args = parser.parse_args()
+
+    school, client_id, secret = get_credentials()
+    vc = Veracross({
+        "school": school,
+        "client_id": client_id,
+        "client_secret": secret,
+        "scopes": ROSTER_SCOPES,
+    })
+    store = RosterStore(args.store)
+
+    if args.command == "sync":
+        print(sync_roster(vc, store, full=args.full))
+        return 0
+
+    refresher = RosterRefresher(vc, store, interval=args.interval)
+    refresher.full_next = args.full
+    refresher.start()
+    try:
+        while True:
+            time.sleep(args.interval)
+            print(f"{store.get_meta('last_synced')}: {refresher.last_error or refresher.last_result}")
+    except KeyboardInterrupt:
+        refresher.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# test_normalize_grades.py
+# normalize_grades() must produce the same table as the loops it replaced.
+#   python -m pytest test_normalize_grades.py
+import pandas as pd
+import pytest
+
+from VCX import GRADE_COLUMNS, normalize_grades
+
+
+def legacy_rows(grades, enrollment_ids, kind):
+    """
+    The page's original per-class loops (and bulk_export's extract_rows),
+    kept here as the reference. Null parents are treated as missing, as
+    extract_rows did; the page loops raised AttributeError on them.
+    """
+    processed_data = []
+    for i in range(0, len(enrollment_ids), 2):
+        current_item = grades[enrollment_ids[i]]
+        class_name = enrollment_ids[i + 1]
+        if not isinstance(current_item, list):
+            continue
+        for item in current_item:
+            if not isinstance(item, dict):
+                continue
+            if kind == "qualitative":
+                abbreviation = (item.get('proficiency_level') or {}).get('abbreviation')
+                if abbreviation is not None:
+                    processed_data.append({
+                        'class': class_name,
+                        'grading_period': (item.get('grading_period') or {}).get('abbreviation'),
+                        'description': (item.get('rubric_criteria') or {}).get('description'),
+                        'score': abbreviation,
+                    })
+            else:
+                abbreviation = item.get('posted_grade')
+                if abbreviation != 0:
+                    processed_data.append({
+                        'class': class_name,
+                        'grading_period': (item.get('grading_period') or {}).get('abbreviation'),
+                        'description': (item.get('grading_period') or {}).get('description'),
+                        'score': abbreviation,
+                        'letter_grade': item.get('posted_letter_grade'),
+                    })
+    return processed_data
+
+
+def assert_matches_legacy(grades, enrollment_ids, kind):
+    expected = pd.DataFrame(legacy_rows(grades, enrollment_ids, kind), columns=GRADE_COLUMNS[kind])
+    if kind == "numeric":
+        # normalize_grades always returns float scores (None becomes NaN)
+        expected["score"] = pd.to_numeric(expected["score"], errors="coerce")
+    actual = normalize_grades(grades, enrollment_ids, kind)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    return actual
+
+
+def period(abbreviation, description=None):
+    return {"abbreviation": abbreviation, "description": description or abbreviation}
+
+
+QUALITATIVE = {
+    101: [
+        {"grading_period": period("Q1"), "rubric_criteria": {"description": "Effort"},
+         "proficiency_level": {"abbreviation": "4"}},
+        {"grading_period": period("Q1"), "rubric_criteria": {"description": "Homework"}},
+        {"grading_period": period("Q1"), "rubric_criteria": {"description": "Participation"},
+         "proficiency_level": None},
+        {"grading_period": period("Q1"), "rubric_criteria": {"description": "Assessment"},
+         "proficiency_level": {"abbreviation": None}},
+        {"grading_period": period("Q2"), "rubric_criteria": {"description": "Effort"},
+         "proficiency_level": {"abbreviation": "3"}},
+        "not a record",
+    ],
+    102: None,  # a failed report card call
+    103: [],
+    104: [
+        {"grading_period": period("Q1"), "rubric_criteria": {"description": "Effort"},
+         "proficiency_level": {"abbreviation": "5"}},
+    ],
+}
+
+NUMERIC = {
+    201: [
+        {"grading_period": period("Q1", "Quarter 1"), "posted_grade": 91.5, "posted_letter_grade": "A-"},
+        {"grading_period": period("Q2", "Quarter 2"), "posted_grade": 0, "posted_letter_grade": None},
+        {"grading_period": period("Q3", "Quarter 3"), "posted_grade": None, "posted_letter_grade": None},
+        {"grading_period": period("Q4", "Quarter 4"), "posted_letter_grade": None},
+    ],
+    202: None,
+    203: [
+        {"grading_period": period("Q1", "Quarter 1"), "posted_grade": 78, "posted_letter_grade": "C+"},
+    ],
+}
+
+
+def test_qualitative_matches_legacy_loops():
+    enrollment_ids = [101, "English 7", 102, "Math 7", 103, "Art", 104, "Science 7"]
+    df = assert_matches_legacy(QUALITATIVE, enrollment_ids, "qualitative")
+    # Missing, None and null-abbreviation proficiency levels are all dropped
+    assert df["score"].tolist() == ["4", "3", "5"]
+    assert df["class"].tolist() == ["English 7", "English 7", "Science 7"]
+
+
+def test_numeric_matches_legacy_loops():
+    enrollment_ids = [201, "English 7", 202, "Math 7", 203, "Science 7"]
+    df = assert_matches_legacy(NUMERIC, enrollment_ids, "numeric")
+    # A posted grade of 0 is dropped; a missing or None one is kept as NaN
+    assert df["grading_period"].tolist() == ["Q1", "Q3", "Q4", "Q1"]
+    assert df["score"].isna().tolist() == [False, True, True, False]
+
+
+@pytest.mark.parametrize("kind", ["qualitative", "numeric"])
+def test_failed_calls_give_no_rows(kind):
+    grades = {1: None, 2: None}
+    df = assert_matches_legacy(grades, [1, "English 7", 2, "Math 7"], kind)
+    assert df.empty
+
+
+@pytest.mark.parametrize("kind", ["qualitative", "numeric"])
+def test_empty_input(kind):
+    df = normalize_grades({}, [], kind)
+    assert df.empty
+    assert list(df.columns) == GRADE_COLUMNS[kind]
+    assert legacy_rows({}, [], kind) == []
+
+
+def test_class_of_dict_and_enrollment_column():
+    df = normalize_grades(NUMERIC, {203: "Science 7", 201: "English 7"}, "numeric", with_enrollment=True)
+    assert list(df.columns) == ["enrollment_id"] + GRADE_COLUMNS["numeric"]
+    assert df["enrollment_id"].tolist() == [203, 201, 201, 201]
+
+
+def test_unknown_kind():
+    with pytest.raises(ValueError):
+        normalize_grades({}, [], "letter")
@@ -0,0 +1,42 @@
+# test_tokens.py
+# Token refreshes against the benchmark.py mock of the Veracross APIs.
+#   python -m pytest test_tokens.py
+import argparse
+
+import pytest
+
+from benchmark import MockData, MockServer, make_client
+
+
+@pytest.fixture
+def server():
+    server = MockServer(MockData(students=10, records=10), latency=0.05).start()
+    yield server
+    server.stop()
+
+
+def client_for(server, workers=8):
+    args = argparse.Namespace(rate_limit=0, rate_window=60, oneroster_page_size=100, workers=workers)
+    return make_client(server, args)
+
+
+def test_concurrent_401s_share_one_refresh(server):
+    vc = client_for(server)
+    # A cached v3 token the server no longer accepts (the mock only takes "mock-..." tokens)
+    vc.tokens._tokens["v3"] = ("revoked", float("inf"))
+    server.reset_counters()
+
+    results = vc.fetch_enrollment_grades(list(range(1, 9)), "numeric", max_workers=8)
+
+    assert all(grades is not None for grades in results.values())
+    assert server.counters.get("tokens") == 1
+
+
+def test_token_is_reused_until_rejected(server):
+    vc = client_for(server)
+    server.reset_counters()
+
+    vc.fetch_enrollment_grades(list(range(1, 5)), "qualitative")
+    vc.fetch_enrollment_grades(list(range(5, 9)), "qualitative")
+
+    assert server.counters.get("tokens") == 1